@@ -0,0 +1,332 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from enxitry.config import CONFIG
+from enxitry.models import DefaultLogTable, LogAction, RowChange, Table
+from enxitry.models.columnar import parse_timestamps
+
+
+def build_sessions(logs: pd.DataFrame) -> pd.DataFrame:
+    """
+    ログから在室していた期間を求める
+
+    学生ごとに時刻順に並べたログのうち、入室の直後に退出が続くものを1つの期間とする。
+    学生の最後のログが入室の場合は在室中の期間とし、退出時刻はNaTとなる。
+    退出が記録されないまま再度入室した場合、前の入室は期間に含めない。
+
+    Args:
+        logs (pd.DataFrame): student_id, timestamp, actionを列に持つログ
+
+    Returns:
+        pd.DataFrame: student_id, enter_at, exit_atを列に持つ期間
+    """
+    df = logs.loc[
+        logs["action"].isin([LogAction.ENTER, LogAction.EXIT]),
+        ["student_id", "timestamp", "action"],
+    ]
+    if df.empty:
+        return pd.DataFrame(
+            {
+                "student_id": pd.Series(dtype=str),
+                "enter_at": pd.Series(dtype=f"datetime64[ns, {CONFIG.timezone}]"),
+                "exit_at": pd.Series(dtype=f"datetime64[ns, {CONFIG.timezone}]"),
+            }
+        )
+
+    timestamps = df["timestamp"]
+    if not isinstance(timestamps.dtype, pd.DatetimeTZDtype):
+        timestamps = parse_timestamps(timestamps)
+    df = df.assign(timestamp=timestamps).sort_values(
+        ["student_id", "timestamp"], kind="stable"
+    )
+
+    student_ids = df["student_id"].to_numpy()
+    is_enter = df["action"].to_numpy() == LogAction.ENTER
+    next_is_same = np.append(student_ids[1:] == student_ids[:-1], False)
+    next_is_exit = np.append(~is_enter[1:], False)
+
+    is_closed = is_enter & next_is_same & next_is_exit
+    is_open = is_enter & ~next_is_same
+    is_session = is_closed | is_open
+
+    enter_at = df["timestamp"]
+    exit_at = enter_at.shift(-1).where(is_closed)
+
+    return pd.DataFrame(
+        {
+            "student_id": student_ids[is_session],
+            "enter_at": enter_at.array[is_session],
+            "exit_at": exit_at.array[is_session],
+        }
+    )
+
+
+def _now() -> pd.Timestamp:
+    return pd.Timestamp.now(tz=CONFIG.timezone)
+
+
+def _to_local(timestamp: pd.Timestamp) -> pd.Timestamp:
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize(CONFIG.timezone)
+    return timestamp.tz_convert(CONFIG.timezone)
+
+
+def _occupancy_events(
+    sessions: pd.DataFrame, now: pd.Timestamp
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    在室者数が変化する時刻と、その時刻以降の在室者数を求める。在室中の期間はnowまで続くものとする。
+
+    Args:
+        sessions (pd.DataFrame): 期間
+        now (pd.Timestamp): 現在時刻
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: 時刻の昇順に並んだ時刻と在室者数
+    """
+    enters = sessions["enter_at"].to_numpy(dtype="datetime64[ns]")
+    exits = (
+        sessions["exit_at"]
+        .fillna(now)
+        .clip(lower=sessions["enter_at"])
+        .to_numpy(dtype="datetime64[ns]")
+    )
+
+    times = np.concatenate([enters, exits])
+    deltas = np.concatenate(
+        [np.ones(len(enters), dtype=np.int64), -np.ones(len(exits), dtype=np.int64)]
+    )
+
+    # 同じ時刻の退出を入室より先に数え、存在しない一瞬の増加を避ける
+    order = np.lexsort((deltas, times))
+    times = times[order]
+    counts = np.cumsum(deltas[order])
+
+    # 同じ時刻の変化はまとめ、最後の在室者数を残す
+    is_last = np.append(times[1:] != times[:-1], True)
+    return times[is_last], counts[is_last]
+
+
+def get_occupancy(
+    sessions: pd.DataFrame,
+    freq: str = "15min",
+    start: pd.Timestamp | None = None,
+    end: pd.Timestamp | None = None,
+    now: pd.Timestamp | None = None,
+) -> pd.Series:
+    """
+    一定間隔ごとの在室者数を求める
+
+    Args:
+        sessions (pd.DataFrame): build_sessions()で求めた期間
+        freq (str): 間隔。pandasの頻度文字列で指定する。
+        start (pd.Timestamp | None): 最初の時刻。Noneの場合は最初の入室時刻。
+        end (pd.Timestamp | None): 最後の時刻。Noneの場合は現在時刻。
+        now (pd.Timestamp | None): 在室中の期間が続いているとみなす時刻。Noneの場合は現在時刻。
+
+    Returns:
+        pd.Series: 時刻をインデックスとする在室者数
+    """
+    now = _now() if now is None else _to_local(now)
+    if sessions.empty:
+        return pd.Series(dtype=np.int64)
+
+    times, counts = _occupancy_events(sessions, now)
+
+    start = sessions["enter_at"].min().floor(freq) if start is None else start
+    end = now if end is None else end
+    # 別のタイムゾーンの日時が渡されても、設定されたタイムゾーンで区切る
+    start, end = _to_local(start), _to_local(end)
+    grid = pd.date_range(start, end, freq=freq, tz=CONFIG.timezone)
+
+    positions = np.searchsorted(times, grid.to_numpy(dtype="datetime64[ns]"), "right")
+    values = np.where(positions > 0, counts[np.maximum(positions - 1, 0)], 0)
+    return pd.Series(values, index=grid, name="occupancy")
+
+
+def get_peak_windows(
+    sessions: pd.DataFrame, top: int = 5, now: pd.Timestamp | None = None
+) -> pd.DataFrame:
+    """
+    在室者数が多かった時間帯を求める
+
+    Args:
+        sessions (pd.DataFrame): build_sessions()で求めた期間
+        top (int): 求める時間帯の数
+        now (pd.Timestamp | None): 在室中の期間が続いているとみなす時刻。Noneの場合は現在時刻。
+
+    Returns:
+        pd.DataFrame: start, end, occupancyを列に持ち、在室者数と長さの降順に並んだ時間帯
+    """
+    now = _now() if now is None else _to_local(now)
+    if sessions.empty:
+        return pd.DataFrame(columns=["start", "end", "occupancy"])
+
+    times, counts = _occupancy_events(sessions, now)
+    windows = pd.DataFrame(
+        {
+            "start": pd.to_datetime(times[:-1], utc=True).tz_convert(CONFIG.timezone),
+            "end": pd.to_datetime(times[1:], utc=True).tz_convert(CONFIG.timezone),
+            "occupancy": counts[:-1],
+        }
+    )
+    windows = windows[windows["occupancy"] > 0]
+    return (
+        windows.assign(length=windows["end"] - windows["start"])
+        .sort_values(["occupancy", "length"], ascending=False)
+        .head(top)
+        .drop(columns="length")
+        .reset_index(drop=True)
+    )
+
+
+def get_student_hours(
+    sessions: pd.DataFrame, include_open: bool = True, now: pd.Timestamp | None = None
+) -> pd.Series:
+    """
+    学生ごとの在室時間の合計を求める
+
+    Args:
+        sessions (pd.DataFrame): build_sessions()で求めた期間
+        include_open (bool): 在室中の期間を現在時刻までの分として含めるかどうか
+        now (pd.Timestamp | None): 在室中の期間が続いているとみなす時刻。Noneの場合は現在時刻。
+
+    Returns:
+        pd.Series: 学籍番号をインデックスとし、在室時間 (時間) の降順に並んだ値
+    """
+    now = _now() if now is None else _to_local(now)
+    exit_at = sessions["exit_at"]
+    if include_open:
+        exit_at = exit_at.fillna(now)
+
+    hours = (exit_at - sessions["enter_at"]).dt.total_seconds() / 3600
+    return (
+        hours.groupby(sessions["student_id"])
+        .sum()
+        .sort_values(ascending=False)
+        .rename("hours")
+    )
+
+
+class AttendanceAnalytics:
+    """
+    ログから求めた在室期間をキャッシュし、新しいログの分だけ更新するクラス
+
+    ログテーブルの変更通知を受け取り、追記されたログは在室中の期間と合わせて処理される。
+    過去のログが編集・削除された場合や、最後に処理したログより古いログが追記された場合は全体を計算し直す。
+    """
+
+    def __init__(self, table: Table | None = None):
+        """
+        Args:
+            table (Table | None): ログのテーブル。Noneの場合はDefaultLogTableが利用される。
+        """
+        self._table = DefaultLogTable() if table is None else table
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.RLock()
+        self._closed: pd.DataFrame | None = None
+        self._open: pd.DataFrame | None = None
+        self._watermark: pd.Timestamp | None = None
+        self._appended: list[dict] = []
+        self._needs_rebuild = True
+
+        self._table.subscribe(self._on_change)
+
+    def _on_change(self, changes: list[RowChange]):
+        with self._lock:
+            for index, old, new, _ in changes:
+                if old is None and new is not None:
+                    self._appended.append(new)
+                elif old != new:
+                    self._needs_rebuild = True
+
+    def _set_sessions(self, sessions: pd.DataFrame):
+        is_open = sessions["exit_at"].isna()
+        self._open = sessions[is_open]
+        self._closed = sessions[~is_open]
+
+    def _rebuild(self):
+        logs = self._table.get_all_as_df()
+        if logs.empty:
+            sessions = build_sessions(
+                pd.DataFrame(columns=["student_id", "timestamp", "action"])
+            )
+            self._watermark = None
+        else:
+            logs = logs.assign(timestamp=parse_timestamps(logs["timestamp"]))
+            sessions = build_sessions(logs)
+            self._watermark = logs["timestamp"].max()
+        self._set_sessions(sessions)
+
+    def _extend(self, appended: pd.DataFrame):
+        """
+        在室中の期間に追記されたログを続けて処理する。
+
+        Args:
+            appended (pd.DataFrame): 最後に処理したログ以降に追記されたログ
+        """
+        seeds = pd.DataFrame(
+            {
+                "student_id": self._open["student_id"],
+                "timestamp": self._open["enter_at"],
+                "action": LogAction.ENTER,
+            }
+        )
+        sessions = build_sessions(pd.concat([seeds, appended], ignore_index=True))
+        is_open = sessions["exit_at"].isna()
+        self._closed = pd.concat([self._closed, sessions[~is_open]], ignore_index=True)
+        self._open = sessions[is_open]
+        self._watermark = max(self._watermark, appended["timestamp"].max())
+
+    def refresh(self):
+        """
+        前回から追記・変更されたログを在室期間に反映する。
+        """
+        with self._refresh_lock:
+            with self._lock:
+                appended, self._appended = self._appended, []
+                needs_rebuild, self._needs_rebuild = self._needs_rebuild, False
+
+            if not needs_rebuild and appended:
+                df = pd.DataFrame(appended)
+                df = df.assign(timestamp=parse_timestamps(df["timestamp"]))
+                needs_rebuild = (
+                    self._watermark is None or df["timestamp"].min() < self._watermark
+                )
+                if not needs_rebuild:
+                    self._extend(df)
+
+            if needs_rebuild:
+                self._rebuild()
+
+    def get_sessions(self) -> pd.DataFrame:
+        """
+        在室期間を取得する
+
+        Returns:
+            pd.DataFrame: student_id, enter_at, exit_atを列に持つ期間。在室中の期間の退出時刻はNaT。
+        """
+        with self._refresh_lock:
+            self.refresh()
+            return pd.concat([self._closed, self._open], ignore_index=True)
+
+    def get_occupancy(self, freq: str = "15min", **kwargs) -> pd.Series:
+        """
+        一定間隔ごとの在室者数を求める。引数はget_occupancy()と同じ。
+        """
+        return get_occupancy(self.get_sessions(), freq, **kwargs)
+
+    def get_peak_windows(self, top: int = 5, **kwargs) -> pd.DataFrame:
+        """
+        在室者数が多かった時間帯を求める。引数はget_peak_windows()と同じ。
+        """
+        return get_peak_windows(self.get_sessions(), top, **kwargs)
+
+    def get_student_hours(self, **kwargs) -> pd.Series:
+        """
+        学生ごとの在室時間の合計を求める。引数はget_student_hours()と同じ。
+        """
+        return get_student_hours(self.get_sessions(), **kwargs)
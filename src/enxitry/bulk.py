@@ -0,0 +1,292 @@
+import argparse
+import datetime
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, TextIO
+
+import pandas as pd
+from loguru import logger
+from pydantic import TypeAdapter, ValidationError
+
+from enxitry.models import (
+    DefaultLogTable,
+    DefaultStudentsTable,
+    Log,
+    LogAction,
+    Student,
+    StudentStatus,
+)
+
+
+ROSTER_COLUMNS = ["sid", "name", "idm"]
+IDM_LENGTH = 16
+
+students_adapter = TypeAdapter(list[Student])
+
+
+@dataclass
+class ImportResult:
+    """
+    一括登録の結果を表すデータクラス
+
+    Attributes:
+        added (list[Student]): 新しく登録される学生
+        updated (list[Student]): 氏名やIDmが更新される学生
+        errors (list[str]): 取り込まれなかった行とその理由
+    """
+
+    added: list[Student] = field(default_factory=list)
+    updated: list[Student] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+
+
+def normalize_idm(idms: pd.Series) -> pd.Series:
+    """
+    IDmをリーダーが返す形式 ("01 2E 3F ...") にそろえる
+
+    Args:
+        idms (pd.Series): 区切り文字の有無や大文字・小文字が混在したIDm
+
+    Returns:
+        pd.Series: そろえたIDm。16桁の16進数でないものはNaN。
+    """
+    digits = idms.str.replace(r"[\s:-]", "", regex=True).str.upper()
+    is_valid = digits.str.fullmatch(rf"[0-9A-F]{{{IDM_LENGTH}}}").fillna(False)
+    spaced = digits.str.findall(r"..").str.join(" ")
+    return spaced.where(is_valid)
+
+
+def read_roster(path: Path | TextIO, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """
+    名簿のCSVを一定の行数ずつ読み込む
+
+    Args:
+        path (Path | TextIO): sid, name, idmを列に持つCSV
+        chunk_size (int): 一度に読み込む行数
+
+    Yields:
+        pd.DataFrame: 読み込んだ行。インデックスはCSVの行番号。
+    """
+    with pd.read_csv(
+        path, dtype=str, keep_default_na=False, chunksize=chunk_size
+    ) as reader:
+        for chunk in reader:
+            missing = set(ROSTER_COLUMNS) - set(chunk.columns)
+            if missing:
+                raise ValueError(f"Missing columns in roster: {sorted(missing)}")
+            # ヘッダを1行目とした行番号にする
+            chunk.index = chunk.index + 2
+            yield chunk[ROSTER_COLUMNS].apply(lambda col: col.str.strip())
+
+
+def validate_chunk(chunk: pd.DataFrame, result: ImportResult) -> pd.DataFrame:
+    """
+    名簿の行を検証し、取り込める行だけを残す
+
+    Args:
+        chunk (pd.DataFrame): 名簿の行
+        result (ImportResult): 取り込めない行を記録する結果
+
+    Returns:
+        pd.DataFrame: 取り込める行
+    """
+    chunk = chunk.assign(idm=normalize_idm(chunk["idm"]))
+
+    invalid = chunk["idm"].isna()
+    for line in chunk.index[invalid]:
+        result.errors.append(f"line {line}: invalid IDm")
+
+    empty = (chunk["sid"] == "") | (chunk["name"] == "")
+    for line in chunk.index[empty & ~invalid]:
+        result.errors.append(f"line {line}: empty sid or name")
+
+    chunk = chunk[~invalid & ~empty]
+
+    # 行ごとにモデルを作らず、チャンク全体をまとめて検証する
+    records = chunk.assign(status=StudentStatus.EXITED).to_dict("records")
+    try:
+        students_adapter.validate_python(records)
+    except ValidationError as e:
+        bad = {error["loc"][0] for error in e.errors()}
+        for position in sorted(bad):
+            result.errors.append(f"line {chunk.index[position]}: invalid row")
+        chunk = chunk.iloc[[i for i in range(len(chunk)) if i not in bad]]
+
+    return chunk
+
+
+def plan_import(path: Path | TextIO, chunk_size: int = 500) -> ImportResult:
+    """
+    名簿を読み込み、登録・更新する学生を決める。テーブルへの書き込みは行わない。
+
+    同じ学籍番号またはIDmが名簿に複数回現れる場合、後の行が採用される。
+    既に登録されている学生は氏名とIDmが更新され、在室状態はそのまま残る。
+    他の学生に登録されているIDmを持つ行は取り込まれない。
+
+    Args:
+        path (Path | TextIO): sid, name, idmを列に持つCSV
+        chunk_size (int): 一度に読み込む行数
+
+    Returns:
+        ImportResult: 登録・更新する学生と、取り込まれなかった行
+    """
+    result = ImportResult()
+    chunks = [validate_chunk(chunk, result) for chunk in read_roster(path, chunk_size)]
+    roster = pd.concat(chunks) if chunks else pd.DataFrame(columns=ROSTER_COLUMNS)
+
+    for column in ["sid", "idm"]:
+        duplicated = roster.duplicated(column, keep="last")
+        for line in roster.index[duplicated]:
+            result.errors.append(f"line {line}: {column} appears again later, skipped")
+        roster = roster[~duplicated]
+
+    existing = DefaultStudentsTable().get_all_as_df()
+    sid_by_idm = (
+        dict(zip(existing["idm"], existing.index)) if not existing.empty else {}
+    )
+
+    owner = roster["idm"].map(sid_by_idm)
+    conflicts = owner.notna() & (owner != roster["sid"])
+    for line, sid in owner[conflicts].items():
+        result.errors.append(f"line {line}: IDm is already registered to {sid}")
+    roster = roster[~conflicts]
+
+    statuses = existing["status"] if not existing.empty else pd.Series(dtype=str)
+    roster = roster.assign(
+        status=roster["sid"].map(statuses).fillna(StudentStatus.EXITED)
+    )
+    is_new = ~roster["sid"].isin(existing.index)
+
+    # 登録内容が変わらない学生は書き込まない
+    if not existing.empty:
+        current = existing.reindex(roster["sid"])
+        is_same = (current["name"].to_numpy() == roster["name"].to_numpy()) & (
+            current["idm"].to_numpy() == roster["idm"].to_numpy()
+        )
+        roster, is_new = roster[~is_same], is_new[~is_same]
+
+    for is_new_value, target in [(True, result.added), (False, result.updated)]:
+        rows = roster[is_new == is_new_value]
+        target.extend(students_adapter.validate_python(rows.to_dict("records")))
+
+    return result
+
+
+def commit_import(result: ImportResult):
+    """
+    一括登録の結果を学生テーブルとログテーブルにまとめて書き込む
+
+    Args:
+        result (ImportResult): plan_import()の結果
+    """
+    students = result.added + result.updated
+    if not students:
+        return
+
+    DefaultStudentsTable().update(students)
+    if result.added:
+        DefaultLogTable().update(
+            [Log.create(student.sid, LogAction.REGISTER) for student in result.added]
+        )
+
+
+def write_csv(dfs: Iterator[pd.DataFrame], out: TextIO, index_label: str):
+    """
+    DataFrameを順にCSVとして書き出す。ヘッダは最初の1つにだけ付けられる。
+
+    Args:
+        dfs (Iterator[pd.DataFrame]): 書き出す内容
+        out (TextIO): 書き出し先
+        index_label (str): インデックスの列名
+    """
+    header = True
+    for df in dfs:
+        df.to_csv(out, header=header, index_label=index_label)
+        header = False
+
+
+def export_students(out: TextIO):
+    """
+    学生テーブルをCSVとして書き出す
+
+    Args:
+        out (TextIO): 書き出し先
+    """
+    write_csv(iter([DefaultStudentsTable().get_all_as_df()]), out, "sid")
+
+
+def export_logs(
+    out: TextIO,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+):
+    """
+    ログテーブルをパーティションごとにCSVとして書き出す
+
+    Args:
+        out (TextIO): 書き出し先
+        start (datetime.datetime | None): 書き出す期間の始まり。Noneの場合は最初から。
+        end (datetime.datetime | None): 書き出す期間の終わり。Noneの場合は最後まで。
+    """
+    table = DefaultLogTable()
+    if start is None and end is None:
+        dfs = table.iter_partitions()
+    else:
+        start = start or datetime.datetime(1970, 1, 1)
+        end = end or datetime.datetime.now(datetime.UTC)
+        dfs = iter([table.get_between(start, end)])
+    write_csv(dfs, out, "id")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog="enxitry-bulk", description="学生の一括登録と、学生・ログの書き出し"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser(
+        "import", help="名簿のCSVから学生を一括登録する"
+    )
+    import_parser.add_argument("roster", type=Path, help="sid, name, idmを列に持つCSV")
+    import_parser.add_argument("--chunk-size", type=int, default=500)
+    import_parser.add_argument(
+        "--dry-run", action="store_true", help="書き込まずに結果だけを表示する"
+    )
+
+    export_parser = subparsers.add_parser("export", help="テーブルをCSVとして書き出す")
+    export_parser.add_argument("table", choices=["students", "logs"])
+    export_parser.add_argument(
+        "--output", "-o", type=Path, help="省略した場合は標準出力"
+    )
+    export_parser.add_argument("--start", type=datetime.datetime.fromisoformat)
+    export_parser.add_argument("--end", type=datetime.datetime.fromisoformat)
+
+    args = parser.parse_args(argv)
+
+    match args.command:
+        case "import":
+            result = plan_import(args.roster, args.chunk_size)
+            for error in result.errors:
+                logger.warning(error)
+            logger.info(
+                f"{len(result.added)} to add, {len(result.updated)} to update, "
+                f"{len(result.errors)} skipped"
+            )
+            if not args.dry_run:
+                commit_import(result)
+                logger.info("Import committed")
+        case "export":
+            out = sys.stdout if args.output is None else args.output.open("w")
+            try:
+                if args.table == "students":
+                    export_students(out)
+                else:
+                    export_logs(out, args.start, args.end)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+
+
+if __name__ == "__main__":
+    main()
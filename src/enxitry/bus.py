@@ -0,0 +1,162 @@
+import asyncio
+import json
+import socket
+import uuid
+
+from loguru import logger
+
+from .config import CONFIG
+from .models import DefaultStudentsTable, RowChange, Table
+
+
+MAX_ROWS_PER_MESSAGE = 50
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """
+    "host:port"形式のアドレスを分解する
+
+    Args:
+        address (str): アドレス。ホストを省略した場合は127.0.0.1とみなす。
+
+    Returns:
+        tuple[str, int]: ホストとポート番号
+    """
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class _BusProtocol(asyncio.DatagramProtocol):
+    def __init__(self, inbox: asyncio.Queue[bytes]):
+        self._inbox = inbox
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]):
+        self._inbox.put_nowait(data)
+
+    def error_received(self, exc: Exception):
+        logger.warning(f"Message bus error: {exc}")
+
+
+class MessageBus:
+    """
+    複数のキオスクの間でテーブルへの書き込みを伝えるメッセージバス
+
+    各ノードはテーブルのキャッシュを持ち、書き込まれた行をUDPで他の全てのノードへ送る。
+    受け取った行は外部へ書き込まずにキャッシュへ反映されるため、
+    各ノードはシートを読み直さなくても他のノードでの入室・退出をすぐに表示できる。
+    メッセージが失われた場合も、シートとの定期的な同期で最終的に一致する。
+    """
+
+    def __init__(self, listen: str, peers: list[str], node_name: str = ""):
+        """
+        Args:
+            listen (str): メッセージを受け取るアドレス ("host:port")。空文字列の場合は何もしない。
+            peers (list[str]): メッセージを送る他のノードのアドレス ("host:port") のリスト
+            node_name (str): ノード名。空文字列の場合はホスト名が利用される。
+        """
+        self._listen = listen
+        self._peers = [parse_address(peer) for peer in peers]
+        # 再起動したノードの連番が前回より小さくなっても捨てられないよう、起動ごとに異なるIDにする
+        self._node = f"{node_name or socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+
+        self._seq = 0
+        self._row_seqs: dict[tuple[str, str, str], int] = {}
+        self._tables: dict[str, Table] = {}
+
+    async def run(self, tables: list[Table] | None = None):
+        """
+        メッセージの送受信を開始する
+
+        Args:
+            tables (list[Table] | None): 書き込みを伝えるテーブル。Noneの場合は学生テーブル。
+        """
+        if not self._listen:
+            return
+
+        tables = [DefaultStudentsTable()] if tables is None else tables
+        self._tables = {table._model.__name__: table for table in tables}
+
+        loop = asyncio.get_running_loop()
+        inbox: asyncio.Queue[bytes] = asyncio.Queue()
+        outbox: asyncio.Queue[tuple[str, list[dict]]] = asyncio.Queue()
+
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _BusProtocol(inbox), local_addr=parse_address(self._listen)
+        )
+        logger.info(f"Message bus {self._node} listening on {self._listen}")
+
+        listeners = {}
+        for name, table in self._tables.items():
+
+            def on_change(changes: list[RowChange], name=name, table=table):
+                if loop.is_closed():
+                    return
+                # シートとの同期や他のノードから受け取った変更は送らない。
+                # 同期で読み込んだシートの内容は他のノードの書き込みより古いことがある
+                rows = [
+                    {table._index_col: change.index, **change.new}
+                    for change in changes
+                    if change.local and change.new is not None
+                ]
+                if rows:
+                    loop.call_soon_threadsafe(outbox.put_nowait, (name, rows))
+
+            table.subscribe(on_change)
+            listeners[name] = on_change
+
+        try:
+            await asyncio.gather(
+                self._send_loop(transport, outbox), self._receive_loop(inbox)
+            )
+        finally:
+            for name, listener in listeners.items():
+                self._tables[name].unsubscribe(listener)
+            transport.close()
+
+    async def _send_loop(
+        self,
+        transport: asyncio.DatagramTransport,
+        outbox: asyncio.Queue[tuple[str, list[dict]]],
+    ):
+        while True:
+            name, rows = await outbox.get()
+            # 1つのデータグラムに収まるよう、行を分けて送る
+            for start in range(0, len(rows), MAX_ROWS_PER_MESSAGE):
+                self._seq += 1
+                message = {
+                    "node": self._node,
+                    "seq": self._seq,
+                    "table": name,
+                    "rows": rows[start : start + MAX_ROWS_PER_MESSAGE],
+                }
+                data = json.dumps(message, ensure_ascii=False).encode()
+                for peer in self._peers:
+                    transport.sendto(data, peer)
+
+    async def _receive_loop(self, inbox: asyncio.Queue[bytes]):
+        while True:
+            data = await inbox.get()
+            try:
+                message = json.loads(data)
+                node, seq, name = message["node"], message["seq"], message["table"]
+                if node == self._node:
+                    continue
+
+                table = self._tables[name]
+                rows = []
+                for row in message["rows"]:
+                    # 順序が入れ替わって届いた場合、同じノードからの同じ行のより新しい内容を残す。
+                    # 他の行は捨てないため、メッセージが前後しても失われない
+                    key = (name, row[table._index_col], node)
+                    if seq <= self._row_seqs.get(key, 0):
+                        continue
+                    self._row_seqs[key] = seq
+                    rows.append(table._model(**row))
+
+                if rows:
+                    await asyncio.to_thread(table.apply_remote, rows)
+            except Exception as e:
+                logger.error(f"Failed to apply message from bus: {e}")
+
+
+bus = MessageBus(CONFIG.bus_listen, CONFIG.bus_peers, CONFIG.bus_node_name)
@@ -1 +1,2 @@
-from .nfc import FelicaReader
+from .nfc import FelicaReader, TapEvent
+from .debounce import TapDebouncer
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic
+from typing import AsyncIterator
+
+import cv2
+import numpy as np
+from loguru import logger
+
+
+ROTATIONS = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
+
+READ_RETRY_INTERVAL = 0.05
+MAX_READ_RETRY_INTERVAL = 1
+RELEASE_TIMEOUT = 2
+
+
+@dataclass
+class Frame:
+    """
+    カメラから読み込んだ1枚の画像を表すデータクラス
+
+    Attributes:
+        seq (int): 読み込んだ順に振られる番号
+        captured_at (float): 読み込んだ時刻 (time.monotonic())
+        image (np.ndarray): 画像。複数の処理で共有されるため書き込みはできない。
+    """
+
+    seq: int
+    captured_at: float
+    image: np.ndarray
+
+
+class CameraCapture:
+    """
+    カメラの画像を専用のスレッドで読み込み続けるクラス
+
+    読み込んだ画像は回転を適用した上で小さなリングバッファに保持され、
+    プレビューとOCRはコピーせずに同じ画像を参照する。
+    """
+
+    def __init__(self, index: int, rotation: int = 0, buffer_size: int = 2):
+        """
+        Args:
+            index (int): カメラの番号
+            rotation (int): 画像を時計回りに回転させる角度。0, 90, 180, 270のいずれか。
+            buffer_size (int): 保持する画像の数
+        """
+        if rotation % 360 not in (0, *ROTATIONS):
+            raise ValueError(f"Unsupported camera rotation: {rotation}")
+
+        self._rotation = ROTATIONS.get(rotation % 360)
+        self._capture = cv2.VideoCapture(index)
+        self._buffer: deque[Frame] = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._waiters: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._running = True
+        self._stopped = threading.Event()
+
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def _read_loop(self):
+        seq = 0
+        retry_interval = READ_RETRY_INTERVAL
+        while self._running:
+            ret, image = self._capture.read()
+            if not ret or image is None:
+                if not self._capture.isOpened():
+                    logger.error("Camera is closed")
+                    break
+                # 読み込みに失敗し続ける間は間隔を空け、CPUを使い切らないようにする
+                self._stopped.wait(retry_interval)
+                retry_interval = min(retry_interval * 2, MAX_READ_RETRY_INTERVAL)
+                continue
+            retry_interval = READ_RETRY_INTERVAL
+
+            if self._rotation is not None:
+                image = cv2.rotate(image, self._rotation)
+            image.flags.writeable = False
+
+            with self._lock:
+                self._buffer.append(Frame(seq, monotonic(), image))
+                waiters = list(self._waiters)
+            seq += 1
+
+            for loop, event in waiters:
+                loop.call_soon_threadsafe(event.set)
+
+        self._capture.release()
+
+    def is_opened(self) -> bool:
+        """
+        カメラから画像を読み込んでいるかどうか
+
+        Returns:
+            bool: 読み込んでいる場合はTrue
+        """
+        return self._running and self._thread.is_alive()
+
+    def latest(self) -> Frame | None:
+        """
+        最新の画像を取得する
+
+        Returns:
+            Frame | None: 最新の画像。まだ読み込まれていない場合はNone。
+        """
+        with self._lock:
+            return self._buffer[-1] if self._buffer else None
+
+    async def frames(self, duration: float) -> AsyncIterator[np.ndarray]:
+        """
+        新しい画像が読み込まれるたびにその画像を返す。処理が追いつかない場合、古い画像は飛ばされる。
+
+        Args:
+            duration (float): 画像を返し続ける時間 (秒)
+
+        Yields:
+            np.ndarray: 画像
+        """
+        deadline = monotonic() + duration
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            self._waiters.add(waiter)
+
+        try:
+            seq = -1
+            while (remaining := deadline - monotonic()) > 0:
+                event.clear()
+                frame = self.latest()
+                if frame is not None and frame.seq > seq:
+                    seq = frame.seq
+                    yield frame.image
+                    continue
+
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def release(self):
+        """
+        読み込みを止め、カメラを解放する
+
+        同じカメラをすぐに開き直せるよう、読み込みのスレッドがカメラを解放するまで待つ。
+        """
+        self._running = False
+        self._stopped.set()
+        if threading.current_thread() is self._thread:
+            return
+        self._thread.join(RELEASE_TIMEOUT)
+        if self._thread.is_alive():
+            logger.warning(f"Camera was not released in {RELEASE_TIMEOUT}s")
@@ -0,0 +1,62 @@
+from collections import deque
+
+
+class TapDebouncer:
+    """
+    同じカードが短時間に繰り返しかざされたことを検出するクラス
+
+    受け付けたタップは時刻ごとのバケットに記録され、
+    窓の外に出たバケットはまとめて破棄される。
+    """
+
+    def __init__(self, window: float, bucket_width: float = 1):
+        """
+        Args:
+            window (float): 同じカードのタップを無視する時間 (秒)
+            bucket_width (float): 1つのバケットが表す時間 (秒)
+        """
+        self._window = window
+        self._bucket_width = bucket_width
+        self._buckets: deque[tuple[int, list[str]]] = deque()
+        self._accepted_at: dict[str, float] = {}
+
+    def _expire(self, now: float):
+        """
+        窓の外に出たバケットを破棄する。
+
+        Args:
+            now (float): 現在時刻
+        """
+        cutoff = now - self._window
+        while (
+            self._buckets and (self._buckets[0][0] + 1) * self._bucket_width <= cutoff
+        ):
+            _, idms = self._buckets.popleft()
+            for idm in idms:
+                if self._accepted_at.get(idm, now) <= cutoff:
+                    del self._accepted_at[idm]
+
+    def accept(self, idm: str, now: float) -> bool:
+        """
+        タップを受け付けるかどうかを判定し、受け付けた場合は記録する。
+
+        Args:
+            idm (str): カードIDm
+            now (float): タップされた時刻 (time.monotonic())
+
+        Returns:
+            bool: 受け付けた場合はTrue。直前に同じカードが受け付けられていた場合はFalse。
+        """
+        self._expire(now)
+
+        accepted_at = self._accepted_at.get(idm)
+        if accepted_at is not None and now - accepted_at < self._window:
+            return False
+
+        bucket = int(now // self._bucket_width)
+        if not self._buckets or self._buckets[-1][0] != bucket:
+            self._buckets.append((bucket, []))
+        self._buckets[-1][1].append(idm)
+        self._accepted_at[idm] = now
+
+        return True
@@ -1,42 +1,227 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Literal
+
+from smartcard import scard
 from smartcard.System import readers as get_readers
-from smartcard.Exceptions import NoCardException
 from smartcard.util import toHexString
 from loguru import logger
 
 from enxitry.config import CONFIG
 
 
+GET_IDM_COMMAND = [0xFF, 0xCA, 0x00, 0x00, 0x00]
+
+
+@dataclass
+class TapEvent:
+    """
+    カードがかざされたことを表すデータクラス
+
+    Attributes:
+        idm (str): カードIDm
+        reader (int): カードがかざされたリーダーの番号
+        action (Literal["enter", "exit"] | None): リーダーに割り当てられた動作。割り当てられていない場合はNone。
+        read_at (float): 読み取った時刻 (time.monotonic())
+    """
+
+    idm: str
+    reader: int
+    action: Literal["enter", "exit"] | None
+    read_at: float
+
+
 class FelicaReader:
     """
     Felicaカードを読み取るクラス
+
+    専用のスレッドがSCardGetStatusChangeで全てのリーダーにカードがかざされるのを待ち、
+    読み取ったIDmをリーダーの番号とともに1つのasyncioのキューへ渡す。
+    PC/SCのコンテキストはスレッドが動いている間使い回される。
     """
 
-    def __init__(self):
-        self._reader = get_readers()[CONFIG.nfc_device_index]
+    def __init__(self, reader_indexes: list[int] | None = None):
+        """
+        Args:
+            reader_indexes (list[int] | None): 利用するリーダーの番号のリスト。Noneの場合は設定値が利用される。
+        """
+        readers = [str(reader) for reader in get_readers()]
+
+        if reader_indexes is None:
+            reader_indexes = CONFIG.nfc_device_indexes
+        if reader_indexes is None:
+            reader_indexes = [CONFIG.nfc_device_index]
+        elif not reader_indexes:
+            reader_indexes = list(range(len(readers)))
+
+        self._reader_names = {index: readers[index] for index in reader_indexes}
+        logger.info(f"Using NFC readers: {self._reader_names}")
 
-    def get_idm(self) -> str | None:
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue[TapEvent] | None = None
+
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def _read_idm(self, context: int, reader_name: str) -> str | None:
         """
-        FelicaのカードIDmを取得する
+        かざされているカードのIDmを読み取る。
+
+        Args:
+            context (int): PC/SCのコンテキスト
+            reader_name (str): リーダー名
 
         Returns:
-            str | None: カードIDm。カードが読み取れなかった場合はNone。
+            str | None: カードIDm。読み取れなかった場合はNone。
         """
-        connection = self._reader.createConnection()
-        try:
-            connection.connect()
-        except NoCardException:
-            return None
-        except Exception as e:
-            logger.error(f"Failed to connect to NFC: {e}")
+        hresult, card, protocol = scard.SCardConnect(
+            context,
+            reader_name,
+            scard.SCARD_SHARE_SHARED,
+            scard.SCARD_PROTOCOL_T0 | scard.SCARD_PROTOCOL_T1,
+        )
+        if hresult != scard.SCARD_S_SUCCESS:
+            logger.error(
+                f"Failed to connect to NFC: {scard.SCardGetErrorMessage(hresult)}"
+            )
             return None
 
-        command = [0xFF, 0xCA, 0x00, 0x00, 0x00]
-        data, sw1, sw2 = connection.transmit(command)
-        connection.disconnect()
+        try:
+            hresult, response = scard.SCardTransmit(card, protocol, GET_IDM_COMMAND)
+        finally:
+            scard.SCardDisconnect(card, scard.SCARD_LEAVE_CARD)
+
+        if hresult != scard.SCARD_S_SUCCESS:
+            logger.error(
+                f"Failed to transmit to NFC: {scard.SCardGetErrorMessage(hresult)}"
+            )
+            return None
 
+        data, (sw1, sw2) = response[:-2], response[-2:]
         if sw1 == 0x90 and sw2 == 0x00 and len(data) == 8:
             return toHexString(data)
 
         logger.error(f"NFC APDU Failed. SW1: {sw1}, SW2: {sw2}")
 
         return None
+
+    def _publish(self, idm: str, reader: int):
+        """
+        読み取ったIDmをキューへ渡す。読み取りを待っている処理がない場合は破棄される。
+
+        Args:
+            idm (str): カードIDm
+            reader (int): リーダーの番号
+        """
+        if self._loop is None or self._loop.is_closed():
+            return
+        event = TapEvent(
+            idm=idm,
+            reader=reader,
+            action=CONFIG.nfc_reader_actions.get(reader),
+            read_at=time.monotonic(),
+        )
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    def _watch(self):
+        while True:
+            hresult, context = scard.SCardEstablishContext(scard.SCARD_SCOPE_USER)
+            if hresult != scard.SCARD_S_SUCCESS:
+                logger.error(
+                    f"Failed to establish PC/SC context: {scard.SCardGetErrorMessage(hresult)}"
+                )
+                time.sleep(1)
+                continue
+
+            try:
+                self._watch_status(context)
+            except Exception as e:
+                logger.error(f"NFC reader stopped: {e}")
+            finally:
+                scard.SCardReleaseContext(context)
+
+            time.sleep(1)
+
+    def _watch_status(self, context: int):
+        """
+        カードの状態の変化を待ち、カードがかざされるたびにIDmを読み取る。
+
+        Args:
+            context (int): PC/SCのコンテキスト
+        """
+        timeout = int(CONFIG.nfc_reading_interval * 1000)
+        readers = {name: index for index, name in self._reader_names.items()}
+        states = [(name, scard.SCARD_STATE_UNAWARE) for name in readers]
+        present = set()
+
+        while True:
+            hresult, changes = scard.SCardGetStatusChange(context, timeout, states)
+            if hresult == scard.SCARD_E_TIMEOUT:
+                continue
+            if hresult != scard.SCARD_S_SUCCESS:
+                raise Exception(scard.SCardGetErrorMessage(hresult))
+
+            states = [
+                (name, event_state & ~scard.SCARD_STATE_CHANGED)
+                for name, event_state, _ in changes
+            ]
+
+            for name, event_state, _ in changes:
+                if event_state & scard.SCARD_STATE_UNAVAILABLE:
+                    raise Exception(f"Reader {name} is unavailable")
+
+                if not event_state & scard.SCARD_STATE_PRESENT:
+                    present.discard(name)
+                    continue
+                if name in present:
+                    continue
+
+                present.add(name)
+                idm = self._read_idm(context, name)
+                if idm is not None:
+                    self._publish(idm, readers[name])
+
+    async def get_event(self, timeout: float = 0) -> TapEvent | None:
+        """
+        いずれかのリーダーにかざされたカードを取得する
+
+        Args:
+            timeout (float): カードがかざされるのを待つ時間 (秒)。0以下の場合は既に読み取られたカードのみを返す。
+
+        Returns:
+            TapEvent | None: かざされたカード。カードが読み取れなかった場合はNone。
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._loop = asyncio.get_running_loop()
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if timeout <= 0:
+                    event = self._queue.get_nowait()
+                else:
+                    event = await asyncio.wait_for(
+                        self._queue.get(), max(0, deadline - time.monotonic())
+                    )
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                return None
+
+            # 誰も待っていない間にかざされたカードは無視する
+            if time.monotonic() - event.read_at <= CONFIG.nfc_event_expiry:
+                return event
+
+    async def get_idm(self, timeout: float = 0) -> str | None:
+        """
+        FelicaのカードIDmを取得する
+
+        Args:
+            timeout (float): カードがかざされるのを待つ時間 (秒)。0以下の場合は既に読み取られたIDmのみを返す。
+
+        Returns:
+            str | None: カードIDm。カードが読み取れなかった場合はNone。
+        """
+        event = await self.get_event(timeout)
+        return None if event is None else event.idm
@@ -1,17 +1,28 @@
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from time import time
 from typing import Literal
 
 import cv2
 import numpy as np
+from loguru import logger
 from paddleocr_onnx import PaddleOcrONNX, get_paddleocr_parameter
 from paddleocr_onnx.pocr_onnx import PPOCR_DIR
 
 from enxitry.config import CONFIG
+from .camera import CameraCapture
 
 
 _default_ocr: PaddleOcrONNX | None = None
-_default_camera: cv2.VideoCapture | None = None
+_default_ocr_lock = threading.Lock()
+_default_camera: CameraCapture | None = None
+_camera_release_timer: threading.Timer | None = None
+_default_executor: "OcrExecutor | None" = None
+
+# 学生証 (ISO/IEC 7810 ID-1) を射影変換した後の大きさ
+CARD_SIZE = (856, 540)
 
 
 @dataclass
@@ -22,10 +33,14 @@ class InfoWrittenOnCard:
     Attributes:
         student_id (str): 学籍番号
         student_name (str): 学生氏名
+        student_id_score (float): 学籍番号の信頼度
+        student_name_score (float): 学生氏名の信頼度
     """
 
     student_id: str
     student_name: str
+    student_id_score: float = 1.0
+    student_name_score: float = 1.0
 
 
 def get_default_ocr() -> PaddleOcrONNX:
@@ -36,14 +51,37 @@ def get_default_ocr() -> PaddleOcrONNX:
         PaddleOcrONNX: OCRインスタンス
     """
     global _default_ocr
-    if _default_ocr is None:
-        param = get_paddleocr_parameter()
-        param.rec_model_dir = PPOCR_DIR / "model/rec_model/en_PP-OCRv3_rec_infer.onnx"
-        param.rec_image_shape = "3, 48, 320"
-        _default_ocr = PaddleOcrONNX(param)
+    with _default_ocr_lock:
+        if _default_ocr is None:
+            param = get_paddleocr_parameter()
+            param.rec_model_dir = (
+                PPOCR_DIR / "model/rec_model/en_PP-OCRv3_rec_infer.onnx"
+            )
+            param.rec_image_shape = "3, 48, 320"
+            _default_ocr = PaddleOcrONNX(param)
     return _default_ocr
 
 
+def warm_up_default_ocr():
+    """
+    デフォルトのOCRインスタンスを読み込み、ダミーの画像で推論して初回の推論を高速化する
+    """
+    start_time = time()
+    ocr = get_default_ocr()
+    loaded_time = time()
+
+    width, height = CARD_SIZE
+    dummy = np.zeros((height, width, 3), dtype=np.uint8)
+    ocr(dummy)
+    ocr.text_recognizer([dummy[: height // 10, : width // 2]])
+    warmed_time = time()
+
+    logger.info(
+        f"OCR loaded in {loaded_time - start_time:.2f}s, "
+        f"first inference took {warmed_time - loaded_time:.2f}s"
+    )
+
+
 def unload_default_ocr():
     """
     デフォルトのOCRインスタンスを解放する
@@ -52,19 +90,58 @@ def unload_default_ocr():
     _default_ocr = None
 
 
-def get_default_camera() -> cv2.VideoCapture:
+def get_default_camera() -> CameraCapture:
     """
     デフォルトのカメラインスタンスを取得する
 
     Returns:
-        cv2.VideoCapture: カメラインスタンス
+        CameraCapture: カメラインスタンス
     """
-    global _default_camera
-    if _default_camera is None or not _default_camera.isOpened():
-        _default_camera = cv2.VideoCapture(CONFIG.ocr_camera_index)
+    global _default_camera, _camera_release_timer
+    if _camera_release_timer is not None:
+        _camera_release_timer.cancel()
+        _camera_release_timer = None
+    if _default_camera is None or not _default_camera.is_opened():
+        start_time = time()
+        _default_camera = CameraCapture(
+            CONFIG.ocr_camera_index, CONFIG.ocr_camera_rotation
+        )
+        logger.info(f"Camera opened in {time() - start_time:.2f}s")
     return _default_camera
 
 
+def get_opened_camera() -> CameraCapture | None:
+    """
+    開いているデフォルトのカメラインスタンスを取得する。カメラを新たに開くことはない。
+
+    Returns:
+        CameraCapture | None: カメラインスタンス。開いていない場合はNone。
+    """
+    camera = _default_camera
+    if camera is None or not camera.is_opened():
+        return None
+    return camera
+
+
+def release_default_camera():
+    """
+    デフォルトのカメラインスタンスを使い終わったことを伝える
+
+    ocr_camera_idle_timeoutが0の場合はすぐに解放し、正の場合はその時間が経ってから解放する。
+    負の場合は開いたままにする。
+    """
+    global _camera_release_timer
+    timeout = CONFIG.ocr_camera_idle_timeout
+    if timeout == 0:
+        unload_default_camera()
+    elif timeout > 0:
+        if _camera_release_timer is not None:
+            _camera_release_timer.cancel()
+        _camera_release_timer = threading.Timer(timeout, unload_default_camera)
+        _camera_release_timer.daemon = True
+        _camera_release_timer.start()
+
+
 def unload_default_camera():
     """
     デフォルトのカメラインスタンスを解放する
@@ -75,26 +152,301 @@ def unload_default_camera():
     _default_camera = None
 
 
+def find_card(img: cv2.Mat) -> cv2.Mat | None:
+    """
+    画像から学生証を探し、正面から見た画像に変換する
+
+    Args:
+        img (cv2.Mat): 画像
+
+    Returns:
+        cv2.Mat | None: 学生証の画像。見つからなかった場合はNone。
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, None)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = CONFIG.ocr_card_min_area * img.shape[0] * img.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+        if cv2.contourArea(contour) < min_area:
+            return None
+        quad = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(quad) == 4 and cv2.isContourConvex(quad):
+            break
+    else:
+        return None
+
+    # 左上、右上、右下、左下の順に並べる
+    points = quad.reshape(4, 2).astype(np.float32)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    top_left, bottom_right = points[np.argmin(sums)], points[np.argmax(sums)]
+    top_right, bottom_left = points[np.argmin(diffs)], points[np.argmax(diffs)]
+
+    # 縦向きにかざされた場合は横向きになるように並べ直す
+    if np.linalg.norm(top_right - top_left) < np.linalg.norm(bottom_left - top_left):
+        top_left, top_right, bottom_right, bottom_left = (
+            top_right,
+            bottom_right,
+            bottom_left,
+            top_left,
+        )
+
+    width, height = CARD_SIZE
+    src = np.array([top_left, top_right, bottom_right, bottom_left])
+    dst = np.array(
+        [[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]],
+        dtype=np.float32,
+    )
+    return cv2.warpPerspective(img, cv2.getPerspectiveTransform(src, dst), CARD_SIZE)
+
+
+def get_sharpness(img: cv2.Mat) -> float:
+    """
+    画像の鮮明さを求める
+
+    Args:
+        img (cv2.Mat): 画像
+
+    Returns:
+        float: ラプラシアンの分散。ぼやけているほど小さい。
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+def read_card_texts(card: cv2.Mat) -> list[tuple[str, float]]:
+    """
+    学生証の画像から文字列を読み取る
+
+    学生証のレイアウトが設定されている場合は、学籍番号と氏名の領域のみを切り出して認識する。
+    設定されていない場合は、学生証の画像全体で文字列の検出と認識を行う。
+
+    Args:
+        card (cv2.Mat): find_card()で得られた学生証の画像
+
+    Returns:
+        list[tuple[str, float]]: 読み取った文字列とその信頼度。上から順に並ぶ。
+    """
+    ocr = get_default_ocr()
+
+    if not CONFIG.ocr_card_layout:
+        _, texts, _ = ocr(card)
+        return texts
+
+    width, height = CARD_SIZE
+    crops = []
+    for field in ("student_id", "student_name"):
+        x, y, w, h = CONFIG.ocr_card_layout[field]
+        crops.append(
+            card[
+                int(y * height) : int((y + h) * height),
+                int(x * width) : int((x + w) * width),
+            ]
+        )
+    texts, _ = ocr.text_recognizer(crops)
+    return texts
+
+
 def find_card_info(img: cv2.Mat) -> InfoWrittenOnCard | None:
     """
     学生証に書かれた情報を読み取る
 
+    学生証が見つからない画像や、ぼやけている画像は文字認識を行わずに読み取れなかったものとする。
+
     Args:
         img (cv2.Mat): 画像
 
     Returns:
         InfoWrittenOnCard | None: 読み取った情報。読み取れなかった場合はNone。
     """
-    ocr = get_default_ocr()
-    bboxes, texts, time = ocr(img)
+    card = find_card(img)
+    if card is None or get_sharpness(card) < CONFIG.ocr_min_sharpness:
+        return None
+
+    texts = read_card_texts(card)
 
     sid = None
-    for box, (text, score) in zip(bboxes, texts):
+    for text, score in texts:
         if sid is None:
             if text.isdigit() and len(text) == 9:
-                sid = text
+                sid, sid_score = text, score
         else:
             if "," in text:  # カンマを含む文字列を氏名として扱う
-                return InfoWrittenOnCard(sid, text)
+                return InfoWrittenOnCard(sid, text, sid_score, score)
 
     return None
+
+
+class CardInfoVoter:
+    """
+    複数の画像から読み取った情報を多数決でまとめるクラス
+
+    各フィールドの文字を位置ごとに信頼度で重み付けして投票し、
+    全ての位置で得票の割合が閾値を超えた時点で結果を確定する。
+    """
+
+    def __init__(self, threshold: float, min_votes: int):
+        """
+        Args:
+            threshold (float): 結果を確定する得票の割合
+            min_votes (int): 結果を確定するのに必要な読み取り結果の数
+        """
+        self._threshold = threshold
+        self._min_votes = min_votes
+        self._votes: dict[str, list[tuple[str, float]]] = {
+            "student_id": [],
+            "student_name": [],
+        }
+
+    def _consensus(self, field: str) -> tuple[str, float]:
+        """
+        フィールドの多数決の結果を求める
+
+        Args:
+            field (str): フィールド名
+
+        Returns:
+            tuple[str, float]: 多数決の結果と、各位置の得票の割合の最小値
+        """
+        votes = self._votes[field]
+        total = sum(score for _, score in votes)
+
+        # 長さの異なる読み取り結果は文字の位置が揃わないため、最も支持された長さのものだけで投票する
+        lengths = Counter()
+        for text, score in votes:
+            lengths[len(text)] += score
+        length = lengths.most_common(1)[0][0]
+
+        chars = []
+        confidence = 1.0
+        for i in range(length):
+            counter = Counter()
+            for text, score in votes:
+                if len(text) == length:
+                    counter[text[i]] += score
+            char, weight = counter.most_common(1)[0]
+            chars.append(char)
+            confidence = min(confidence, weight / total)
+
+        return "".join(chars), confidence
+
+    def add(self, info: InfoWrittenOnCard) -> InfoWrittenOnCard | None:
+        """
+        読み取った情報を投票する
+
+        Args:
+            info (InfoWrittenOnCard): 1枚の画像から読み取った情報
+
+        Returns:
+            InfoWrittenOnCard | None: 結果が確定した場合はその情報。確定していない場合はNone。
+        """
+        self._votes["student_id"].append((info.student_id, info.student_id_score))
+        self._votes["student_name"].append((info.student_name, info.student_name_score))
+
+        if len(self._votes["student_id"]) < self._min_votes:
+            return None
+
+        result = self.best()
+        if min(result.student_id_score, result.student_name_score) < self._threshold:
+            return None
+        return result
+
+    def best(self) -> InfoWrittenOnCard | None:
+        """
+        現時点での多数決の結果を取得する
+
+        Returns:
+            InfoWrittenOnCard | None: 多数決の結果。投票がない場合はNone。
+        """
+        if not self._votes["student_id"]:
+            return None
+
+        sid, sid_confidence = self._consensus("student_id")
+        name, name_confidence = self._consensus("student_name")
+        return InfoWrittenOnCard(sid, name, sid_confidence, name_confidence)
+
+
+class OcrExecutor:
+    """
+    find_card_infoを専用のスレッドプールで実行するクラス
+
+    全てのワーカーが処理中の場合、新しい画像は1枚だけ待機させ、
+    それより前に待機していた画像は処理せずにキャンセルする。
+    ONNX Runtimeは推論中にGILを解放するため、ワーカーの数だけ並列に処理される。
+    """
+
+    def __init__(self, workers: int):
+        """
+        Args:
+            workers (int): ワーカーの数
+        """
+        self._workers = workers
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="ocr")
+        # 処理がすぐに終わった場合、_done()は_start()の中から呼ばれる
+        self._lock = threading.RLock()
+        self._running = 0
+        self._pending: tuple[cv2.Mat, Future] | None = None
+
+    def submit(self, img: cv2.Mat) -> Future[InfoWrittenOnCard | None]:
+        """
+        画像の読み取りを依頼する
+
+        Args:
+            img (cv2.Mat): 画像
+
+        Returns:
+            Future[InfoWrittenOnCard | None]: 読み取り結果。より新しい画像に置き換えられた場合はキャンセルされる。
+        """
+        future = Future()
+        with self._lock:
+            if self._running < self._workers:
+                self._start(img, future)
+            else:
+                if self._pending is not None:
+                    self._pending[1].cancel()
+                self._pending = (img, future)
+        return future
+
+    def _start(self, img: cv2.Mat, future: Future):
+        if not future.set_running_or_notify_cancel():
+            return
+        self._running += 1
+        task = self._pool.submit(find_card_info, img)
+        task.add_done_callback(lambda task: self._done(task, future))
+
+    def _done(self, task: Future, future: Future):
+        try:
+            future.set_result(task.result())
+        except Exception as e:
+            future.set_exception(e)
+
+        with self._lock:
+            self._running -= 1
+            if self._pending is not None:
+                img, pending = self._pending
+                self._pending = None
+                self._start(img, pending)
+
+    def cancel_pending(self):
+        """
+        待機している画像をキャンセルする。処理中の画像の結果は破棄されない。
+        """
+        with self._lock:
+            if self._pending is not None:
+                self._pending[1].cancel()
+                self._pending = None
+
+
+def get_default_ocr_executor() -> OcrExecutor:
+    """
+    デフォルトのOCR実行器を取得する
+
+    Returns:
+        OcrExecutor: OCR実行器
+    """
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = OcrExecutor(CONFIG.ocr_workers)
+    return _default_executor
@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 
 from pydantic_settings import (
     BaseSettings,
@@ -20,25 +21,64 @@ class Config(BaseSettings):
 
     timezone: str = "Asia/Tokyo"
 
+    storage_backend: Literal["gsheets", "sqlite"] = "gsheets"
+    sqlite_path: Path = data_dir / "enxitry.db"
+    sqlite_gsheets_mirror: bool = True
+    log_partition: Literal["month", "term"] = "month"
+
     gsheets_service_account_file: Path = data_dir / "gsheets-cred.json"
     gsheets_url: str = ""
     gsheets_error_retries: int = 3
+    gsheets_sync_interval: float = 60
+    gsheets_snapshot_dir: Path = data_dir / "snapshots"
+
+    write_queue_journal_path: Path = data_dir / "write-queue.jsonl"
+    write_queue_flush_interval: float = 1
+    write_queue_max_backoff: float = 60
+    status_update_retries: int = 3
+
+    bus_listen: str = ""
+    bus_peers: list[str] = []
+    bus_node_name: str = ""
 
     slack_webhook_url: str = ""
+    slack_coalesce_window: float = 30
+    slack_timeout: float = 10
+    slack_max_retries: int = 5
+    slack_min_interval: float = 1
 
     nfc_device_index: int = 0
+    nfc_device_indexes: list[int] | None = None
+    nfc_reader_actions: dict[int, Literal["enter", "exit"]] = {}
     nfc_reading_interval: float = 0.1
+    nfc_event_expiry: float = 1
+    nfc_debounce_window: float = 5
 
     ocr_camera_index: int = 0
     ocr_camera_rotation: int = 0
+    ocr_camera_idle_timeout: float = 0
+    ocr_warm_up: bool = True
     delay_before_ocr: int = 3
     ocr_timeout: int = 30
+    ocr_workers: int = 2
+    ocr_consensus_threshold: float = 0.6
+    ocr_consensus_min_frames: int = 3
+    ocr_card_min_area: float = 0.1
+    ocr_min_sharpness: float = 100
+    ocr_card_layout: dict[
+        Literal["student_id", "student_name"], tuple[float, float, float, float]
+    ] = {}
     ocr_info_valid_timeout: int = 10
     size_displayed_camera_image: int = 256
+    camera_stream_quality: int = 70
+    camera_stream_fps: float = 15
 
     registration_completion_display_time: int = 3
 
-    students_table_update_interval: float = 15
+    students_table_update_interval: float = 300
+
+    checkout_sweep_enabled: bool | None = None
+    checkout_sweep_time: str = ""
 
     model_config = SettingsConfigDict(
         env_prefix="ENXITRY_",
@@ -1,11 +1,62 @@
+import asyncio
+
 import reflex as rx
 from loguru import logger
 
+from .card import ocr
+from . import jobs, slack
+from .bus import bus
 from .config import CONFIG
+from .kiosk import kiosk
 from .pages import students
+from .scheduler import parse_daily_time, scheduler
+from .stream import CAMERA_STREAM_PATH, camera_stream
 
 logger.add(
     CONFIG.log_path, rotation=CONFIG.log_rotation, retention=CONFIG.log_retention
 )
 
+
+async def warm_up():
+    """
+    OCRのモデルを読み込み、設定に応じてカメラを開いておく
+    """
+    if CONFIG.ocr_warm_up:
+        await asyncio.to_thread(ocr.warm_up_default_ocr)
+    if CONFIG.ocr_camera_idle_timeout < 0:
+        await asyncio.to_thread(ocr.get_default_camera)
+
+
+def schedule_checkout_sweep():
+    """
+    在室のままの学生を退出させるジョブを登録する
+
+    複数のキオスクで運用する場合 (bus_peersを設定した場合) は既定で無効になるため、1台だけでcheckout_sweep_enabledを有効にする。
+    実行時刻を指定しない場合はログのローテーションの時刻が利用される。
+    """
+    enabled = CONFIG.checkout_sweep_enabled
+    if enabled is None:
+        enabled = not CONFIG.bus_peers
+    if not enabled:
+        return
+
+    value = CONFIG.checkout_sweep_time or CONFIG.log_rotation
+    try:
+        at = parse_daily_time(value)
+    except ValueError:
+        logger.warning(
+            f"Checkout sweep is disabled: {value!r} is not a time of day (HH:MM)"
+        )
+        return
+    scheduler.add_daily("checkout_sweep", at, jobs.checkout_entered_students)
+
+
+schedule_checkout_sweep()
+
 app = rx.App()
+app.register_lifespan_task(warm_up)
+app.register_lifespan_task(kiosk.run)
+app.register_lifespan_task(slack.notifier.run)
+app.register_lifespan_task(bus.run)
+app.register_lifespan_task(scheduler.run)
+app.api.add_api_route(CAMERA_STREAM_PATH, camera_stream)
@@ -0,0 +1,52 @@
+import threading
+
+from loguru import logger
+
+
+_lock = threading.Lock()
+_errors: dict[str, str] = {}
+
+
+def report(component: str, error: str | None = None):
+    """
+    コンポーネントの状態を報告する
+
+    状態が変化した場合はログに記録される。
+
+    Args:
+        component (str): コンポーネント名
+        error (str | None): 異常の内容。正常な場合はNone。
+    """
+    with _lock:
+        previous = _errors.get(component)
+        if error is None:
+            _errors.pop(component, None)
+        else:
+            _errors[component] = error
+
+    if previous is None and error is not None:
+        logger.warning(f"{component} is degraded: {error}")
+    elif previous is not None and error is None:
+        logger.info(f"{component} has recovered")
+
+
+def get_errors() -> dict[str, str]:
+    """
+    異常のあるコンポーネントを取得する
+
+    Returns:
+        dict[str, str]: コンポーネント名と異常の内容
+    """
+    with _lock:
+        return dict(_errors)
+
+
+def is_degraded() -> bool:
+    """
+    異常のあるコンポーネントが存在するかどうか
+
+    Returns:
+        bool: 異常のあるコンポーネントが存在する場合はTrue
+    """
+    with _lock:
+        return bool(_errors)
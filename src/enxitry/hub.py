@@ -0,0 +1,114 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Literal
+
+
+@dataclass
+class HubMessage:
+    """
+    クライアントへ配信するメッセージを表すデータクラス
+
+    Attributes:
+        kind (Literal["state", "toast"]): メッセージの種類
+        payload (Any): "state"の場合は変数名と値の辞書、"toast"の場合はトーストの種類と本文のタプル
+    """
+
+    kind: Literal["state", "toast"]
+    payload: Any
+
+
+class Hub:
+    """
+    アプリ全体で1つのサービスからクライアントへ画面の状態を配信するクラス
+
+    配信された状態は保持され、新しく購読したクライアントにはまず現在の状態がまとめて届く。
+    同じクライアントが購読し直した場合、古い購読はすぐに終了させられる。
+    全ての操作はイベントループのスレッドから行う必要がある。
+    """
+
+    def __init__(self, max_queue_size: int = 100):
+        """
+        Args:
+            max_queue_size (int): クライアントごとに溜めておくメッセージの数。溢れた場合は溜まったメッセージが現在の状態に置き換えられる。
+        """
+        self._max_queue_size = max_queue_size
+        self._state: dict[str, Any] = {}
+        self._subscribers: dict[str, asyncio.Queue[HubMessage | None]] = {}
+
+    def subscribe(self, client: str) -> asyncio.Queue[HubMessage | None]:
+        """
+        クライアントへの配信を開始する
+
+        Args:
+            client (str): クライアントを識別する文字列
+
+        Returns:
+            asyncio.Queue[HubMessage | None]: メッセージが届くキュー。Noneが届いた場合は購読が終了している。
+        """
+        previous = self._subscribers.get(client)
+        if previous is not None:
+            self._put(previous, None)
+
+        queue = asyncio.Queue(self._max_queue_size)
+        queue.put_nowait(HubMessage("state", dict(self._state)))
+        self._subscribers[client] = queue
+        return queue
+
+    def unsubscribe(self, client: str, queue: asyncio.Queue[HubMessage | None]):
+        """
+        クライアントへの配信を終了する
+
+        Args:
+            client (str): クライアントを識別する文字列
+            queue (asyncio.Queue[HubMessage | None]): subscribe()で受け取ったキュー
+        """
+        if self._subscribers.get(client) is queue:
+            del self._subscribers[client]
+
+    def set_state(self, **values: Any):
+        """
+        画面の状態を更新し、全てのクライアントへ配信する
+
+        Args:
+            **values (Any): 変数名と値
+        """
+        self._state.update(values)
+        self._broadcast(HubMessage("state", values))
+
+    def get_state(self, name: str, default: Any = None) -> Any:
+        """
+        現在の画面の状態を取得する
+
+        Args:
+            name (str): 変数名
+            default (Any): 状態が設定されていない場合の値
+
+        Returns:
+            Any: 値
+        """
+        return self._state.get(name, default)
+
+    def toast(self, kind: Literal["info", "success", "error"], message: str):
+        """
+        全てのクライアントにトーストを表示させる
+
+        Args:
+            kind (Literal["info", "success", "error"]): トーストの種類
+            message (str): 本文
+        """
+        self._broadcast(HubMessage("toast", (kind, message)))
+
+    def _broadcast(self, message: HubMessage):
+        for queue in self._subscribers.values():
+            self._put(queue, message)
+
+    def _put(self, queue: asyncio.Queue[HubMessage | None], message: HubMessage | None):
+        # 溢れた差分は捨て、代わりに現在の状態をまとめて届ける
+        if queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(HubMessage("state", dict(self._state)))
+        queue.put_nowait(message)
+
+
+hub = Hub()
@@ -0,0 +1,56 @@
+from loguru import logger
+
+from . import slack
+from .models import (
+    DefaultStudentsTable,
+    DefaultWriteBehindQueue,
+    Log,
+    LogAction,
+    Student,
+    StudentStatus,
+)
+
+
+def checkout_entered_students() -> list[Student]:
+    """
+    退出し忘れて在室のままの学生を全員退出させる
+
+    在室状態は全員分をまとめたcompare_and_set_manyで変更されるため、同時に退出のカードをかざした学生の記録は失われない。
+    比較は1つのロックの中で行われ、変更した学生の在室状態と退出のログは1回でジャーナルに記録される。
+    Slackには1通の要約だけが送られる。
+
+    Returns:
+        list[Student]: 退出させた学生
+    """
+    df = DefaultStudentsTable().get_all_as_df()
+    if not df.empty:
+        df = df[df["status"] == StudentStatus.ENTERED]
+    if df.empty:
+        logger.info("No students to check out")
+        return []
+
+    pairs = []
+    for sid, row in df.iterrows():
+        entered = Student(
+            sid=sid, idm=row["idm"], name=row["name"], status=StudentStatus.ENTERED
+        )
+        pairs.append(
+            (entered, entered.model_copy(update={"status": StudentStatus.EXITED}))
+        )
+
+    # 読み込んでから変更されていた学生は、その時点で退出しているか再び入室しているため対象外とする
+    students = DefaultWriteBehindQueue().compare_and_set_many(
+        pairs,
+        extra_rows=lambda rows: [Log.create(row.sid, LogAction.EXIT) for row in rows],
+    )
+    if len(students) < len(pairs):
+        logger.info(
+            f"Status of {len(pairs) - len(students)} students was changed during checkout, skipped"
+        )
+    if not students:
+        return []
+
+    logger.info(f"Checked out {len(students)} students")
+    names = "、".join(student.name for student in students)
+    slack.send_message(f"在室のままの{len(students)}人を自動で退出させました: {names}")
+    return students
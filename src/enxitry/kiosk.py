@@ -0,0 +1,338 @@
+import asyncio
+import time
+from enum import Enum
+
+import pandas as pd
+import reflex as rx
+from loguru import logger
+
+from enxitry import health, slack
+from enxitry.card import FelicaReader, TapDebouncer, ocr
+from enxitry.config import CONFIG
+from enxitry.hub import hub
+from enxitry.models import (
+    DefaultStudentsTable,
+    DefaultWriteBehindQueue,
+    Log,
+    LogAction,
+    RowChange,
+    Student,
+    StudentStatus,
+)
+from enxitry.stream import CAMERA_STREAM_PATH
+
+
+HEALTH_CHECK_INTERVAL = 5
+
+
+class NFCStatus(Enum):
+    BUSY = ("BUSY", "red")
+    READY = ("READY", "green")
+
+
+class KioskService:
+    """
+    カードリーダーと在室者一覧をアプリ全体で1つだけ管理するサービス
+
+    アプリの起動時に1度だけ開始され、画面の状態はhubを通して全てのクライアントへ配信される。
+    """
+
+    def __init__(self):
+        self._reader: FelicaReader | None = None
+        self._debouncer = TapDebouncer(CONFIG.nfc_debounce_window)
+        self._students = pd.DataFrame(columns=["氏名"])
+
+    async def run(self):
+        """
+        カードリーダーと学生テーブルの監視を開始する
+        """
+        # 書き込みキューを起動し、前回の終了時にシートへ書き込めなかった変更を再度書き込む。
+        # インポートやエクスポートの際にワーカーが動かないよう、アプリの起動時に行う
+        await asyncio.to_thread(DefaultWriteBehindQueue)
+        self._reader = await asyncio.to_thread(FelicaReader)
+        self._set_nfc_status(NFCStatus.BUSY)
+        hub.set_state(is_degraded=health.is_degraded())
+
+        await asyncio.gather(self._watch_table(), self._watch_nfc())
+
+    def _set_nfc_status(self, status: NFCStatus):
+        hub.set_state(nfc_status_text=status.value[0], nfc_status_color=status.value[1])
+
+    def _load_students(self) -> pd.DataFrame:
+        """
+        在室している学生の一覧を学生テーブルから作り直す
+
+        Returns:
+            pd.DataFrame: 学籍番号をインデックスとし、氏名を列に持つ一覧
+        """
+        df = DefaultStudentsTable().get_all_as_df()
+        df = df[df["status"] == StudentStatus.ENTERED]
+        df.drop(["idm", "status"], axis=1, inplace=True)
+        df.columns = ["氏名"]
+        return df
+
+    def _apply_changes(self, changes: list[RowChange]) -> bool:
+        """
+        学生テーブルの変更のうち、入室・退出に関わるものを在室者一覧に反映する。
+
+        Args:
+            changes (list[RowChange]): 学生テーブルの変更
+
+        Returns:
+            bool: 在室者一覧が変わった場合はTrue
+        """
+        entered = {}
+        left = []
+        for index, _, new, _ in changes:
+            if new is not None and new["status"] == StudentStatus.ENTERED:
+                if self._students["氏名"].get(index) != new["name"]:
+                    entered[index] = new["name"]
+            elif index in self._students.index:
+                left.append(index)
+
+        if not entered and not left:
+            return False
+
+        df = self._students.drop(left)
+        for index, name in entered.items():
+            df.loc[index, "氏名"] = name
+        self._students = df
+        return True
+
+    async def _watch_table(self):
+        # テーブルへの書き込みは変更された行だけが通知されるため、
+        # 全体の読み直しはシートを直接編集された場合に備えてたまに行うだけでよい
+        loop = asyncio.get_running_loop()
+        changes_queue: asyncio.Queue[list[RowChange]] = asyncio.Queue()
+
+        def on_change(changes: list[RowChange]):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(changes_queue.put_nowait, changes)
+
+        table = DefaultStudentsTable()
+        table.subscribe(on_change)
+        try:
+            reload_at = 0
+            while True:
+                if time.monotonic() >= reload_at:
+                    self._students = await asyncio.to_thread(self._load_students)
+                    hub.set_state(students=self._students)
+                    reload_at = time.monotonic() + CONFIG.students_table_update_interval
+
+                try:
+                    changes = await asyncio.wait_for(
+                        changes_queue.get(), HEALTH_CHECK_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    changes = []
+                while not changes_queue.empty():
+                    changes += changes_queue.get_nowait()
+
+                if self._apply_changes(changes):
+                    hub.set_state(students=self._students)
+
+                is_degraded = health.is_degraded()
+                if hub.get_state("is_degraded") != is_degraded:
+                    hub.set_state(is_degraded=is_degraded)
+        finally:
+            table.unsubscribe(on_change)
+
+    async def _get_idm(self, timeout: float = 0) -> str | None:
+        self._set_nfc_status(NFCStatus.READY)
+        idm = await self._reader.get_idm(timeout)
+        self._set_nfc_status(NFCStatus.BUSY)
+        return idm
+
+    async def _register_student(self, idm: str):
+        hub.set_state(is_open_register_dialog_1=True)
+
+        camera = ocr.get_default_camera()
+
+        # 接続のたびに新しいストリームを開くよう、URLを毎回変える
+        hub.set_state(
+            camera_stream_url=f"{rx.config.get_config().api_url}{CAMERA_STREAM_PATH}?t={time.time()}"
+        )
+
+        await asyncio.sleep(CONFIG.delay_before_ocr)
+
+        executor = ocr.get_default_ocr_executor()
+        voter = ocr.CardInfoVoter(
+            CONFIG.ocr_consensus_threshold, CONFIG.ocr_consensus_min_frames
+        )
+        futures = []
+        info = None
+        async for frame in camera.frames(CONFIG.ocr_timeout):
+            done = [future for future in futures if future.done()]
+            futures = [future for future in futures if not future.done()]
+            for future in done:
+                if future.cancelled():
+                    continue
+                # 1枚の画像の読み取りに失敗しても、登録は他の画像で続ける
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning(f"Failed to read card from frame: {e}")
+                    continue
+                if result:
+                    info = voter.add(result)
+                    if info:
+                        break
+            if info:
+                break
+
+            # 古い画像は実行器がキャンセルするため、常に最新の画像を渡せばよい
+            futures.append(executor.submit(frame))
+
+        executor.cancel_pending()
+
+        # 閾値に届かなかった場合も、読み取れた情報があれば確認してもらう
+        if not info:
+            info = voter.best()
+
+        hub.set_state(is_open_register_dialog_1=False, camera_stream_url="")
+
+        # カメラの解放を待つ間もイベントループを止めない
+        await asyncio.to_thread(ocr.release_default_camera)
+
+        if not info:
+            return
+
+        hub.set_state(
+            recognized_info=[[info.student_id, info.student_name]],
+            ocr_info_valid_time_prog=0,
+            is_open_register_dialog_2=True,
+        )
+
+        task_get_idm = asyncio.create_task(
+            self._get_idm(timeout=CONFIG.ocr_info_valid_timeout)
+        )
+
+        for i in range(CONFIG.ocr_info_valid_timeout):
+            if task_get_idm.done():
+                break
+            await asyncio.sleep(1)
+            hub.set_state(ocr_info_valid_time_prog=i)
+
+        hub.set_state(is_open_register_dialog_2=False)
+
+        _idm = await task_get_idm
+        if idm != _idm:
+            return await self._register_student(idm)
+
+        hub.set_state(is_open_register_dialog_3=True)
+
+        start_time = time.time()
+
+        student = Student(
+            sid=info.student_id,
+            idm=idm,
+            name=info.student_name,
+            status=StudentStatus.ENTERED,
+        )
+
+        # 月や学期が変わった直後の書き込みはパーティションを開くため、イベントループの外で行う
+        await asyncio.to_thread(
+            DefaultWriteBehindQueue().put,
+            [
+                student,
+                Log.create(student.sid, LogAction.REGISTER),
+                Log.create(student.sid, LogAction.ENTER),
+            ],
+        )
+
+        slack.notify("新規登録", student.name)
+
+        delay = CONFIG.registration_completion_display_time - (time.time() - start_time)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        hub.set_state(is_open_register_dialog_3=False)
+
+    async def _watch_nfc(self):
+        self._set_nfc_status(NFCStatus.READY)
+
+        while True:
+            event = await self._reader.get_event(1)
+            if event is None:
+                continue
+
+            if not self._debouncer.accept(event.idm, event.read_at):
+                logger.debug(f"Ignored repeated tap of {event.idm}")
+                continue
+
+            self._set_nfc_status(NFCStatus.BUSY)
+
+            try:
+                await self._handle_tap(event.idm, event.action)
+            except Exception as e:
+                logger.error(f"Failed to handle tap of {event.idm}: {e}")
+
+            self._set_nfc_status(NFCStatus.READY)
+
+    async def _handle_tap(self, idm: str, reader_action: str | None):
+        """
+        かざされたカードに応じて学生を登録するか、入室・退出させる。
+
+        Args:
+            idm (str): カードIDm
+            reader_action (str | None): リーダーに割り当てられた動作
+        """
+        table = DefaultStudentsTable()
+        queue = DefaultWriteBehindQueue()
+
+        # 読み込んでから書き込むまでに他の端末やシートの編集で在室状態が変わった場合は、
+        # 読み直して動作を決め直す
+        for attempt in range(CONFIG.status_update_retries + 1):
+            student = table.get_by_idm(idm)
+            if not student:
+                try:
+                    await self._register_student(idm)
+                except Exception as e:
+                    logger.error(f"Failed to register student: {e}")
+                    hub.toast(
+                        "error", "学生の登録に失敗しました。もう一度試してください。"
+                    )
+                return
+
+            # 入室用・退出用のリーダーでは在室状態に関わらず動作が決まる
+            if reader_action is not None:
+                action = LogAction(reader_action)
+            elif student.status == StudentStatus.ENTERED:
+                action = LogAction.EXIT
+            else:
+                action = LogAction.ENTER
+
+            status = (
+                StudentStatus.EXITED
+                if action == LogAction.EXIT
+                else StudentStatus.ENTERED
+            )
+            is_changed = student.status != status
+            if not is_changed:
+                break
+
+            updated = student.model_copy(update={"status": status})
+            if await asyncio.to_thread(queue.compare_and_set, student, updated):
+                break
+
+            logger.warning(
+                f"Status of {student.sid} was changed concurrently, retrying ({attempt + 1})"
+            )
+        else:
+            hub.toast(
+                "error", "在室状態を更新できませんでした。もう一度試してください。"
+            )
+            return
+
+        # 在室者一覧はテーブルの変更通知を受けた_watch_tableが更新する
+        if action == LogAction.EXIT:
+            hub.toast("info", f"{student.name}さん、お疲れ様です!")
+        else:
+            hub.toast("success", f"{student.name}さん、こんにちは!")
+
+        if is_changed:
+            await asyncio.to_thread(queue.put, [Log.create(student.sid, action)])
+            slack.notify("退出" if action == LogAction.EXIT else "入室", student.name)
+
+
+kiosk = KioskService()
@@ -1,2 +1,9 @@
+from .table import Table, RowChange, ChangeListener, diff_df
+from .columnar import LazyModelList, coerce_df, models_to_df, parse_timestamps
+from .gspread import GSpreadTable
+from .sqlite import SQLiteTable
+from .partition import PartitionedTable, get_partition_key
+from .backend import DefaultTable, create_table, create_partitioned_table
 from .student import Student, StudentStatus, DefaultStudentsTable
 from .log import Log, LogAction, DefaultLogTable
+from .writer import WriteBehindQueue, DefaultWriteBehindQueue
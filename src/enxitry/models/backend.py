@@ -0,0 +1,219 @@
+import pandas as pd
+
+from enxitry.config import CONFIG
+from .gspread import GSpreadTable, list_sheets
+from .partition import Granularity, PartitionedTable
+from .sqlite import SQLiteTable, list_tables
+from .table import ChangeListener, Table
+
+
+def create_table[T](
+    model: T,
+    unique_cols: list[str] | None = None,
+    index_cols: list[str] | None = None,
+    snapshot: bool = False,
+    name: str = "",
+    sync: bool = True,
+) -> Table[T]:
+    """
+    設定で選択されたバックエンドのテーブルを生成する
+
+    Args:
+        model (T): モデルとなるデータクラス
+        unique_cols (list[str] | None): get_by()で値から行を引くフィールド名のリスト
+        index_cols (list[str] | None): unique_cols以外にインデックスを張るフィールド名のリスト
+        snapshot (bool): シートに接続できない場合に備えて、シートの内容をローカルに保存するかどうか
+        name (str): シート名・テーブル名。空文字列の場合はモデル名が利用される。
+        sync (bool): シート側で直接編集された内容を定期的に取り込むかどうか
+
+    Returns:
+        Table[T]: テーブル
+    """
+    if name == "":
+        name = model.__name__
+
+    snapshot_path = None
+    if snapshot:
+        snapshot_path = CONFIG.gsheets_snapshot_dir / f"{name}.csv"
+
+    sync_interval = None if sync else 0
+
+    match CONFIG.storage_backend:
+        case "gsheets":
+            return GSpreadTable(
+                model,
+                CONFIG.gsheets_url,
+                CONFIG.gsheets_service_account_file,
+                sheet_name=name,
+                unique_cols=unique_cols,
+                sync_interval=sync_interval,
+                snapshot_path=snapshot_path,
+            )
+        case "sqlite":
+            mirror = None
+            if CONFIG.sqlite_gsheets_mirror and CONFIG.gsheets_url:
+                mirror = GSpreadTable(
+                    model,
+                    CONFIG.gsheets_url,
+                    CONFIG.gsheets_service_account_file,
+                    sheet_name=name,
+                    unique_cols=unique_cols,
+                    sync_interval=sync_interval,
+                )
+            return SQLiteTable(
+                model,
+                CONFIG.sqlite_path,
+                table_name=name,
+                unique_cols=unique_cols,
+                index_cols=index_cols,
+                mirror=mirror,
+            )
+
+    raise ValueError(f"Unknown storage backend: {CONFIG.storage_backend}")
+
+
+def list_table_names() -> list[str]:
+    """
+    設定で選択されたバックエンドに保存されている全てのシート名・テーブル名を取得する
+
+    Returns:
+        list[str]: シート名・テーブル名
+    """
+    match CONFIG.storage_backend:
+        case "gsheets":
+            return list_sheets(CONFIG.gsheets_url, CONFIG.gsheets_service_account_file)
+        case "sqlite":
+            names = list_tables(CONFIG.sqlite_path)
+            if CONFIG.sqlite_gsheets_mirror and CONFIG.gsheets_url:
+                names += list_sheets(
+                    CONFIG.gsheets_url, CONFIG.gsheets_service_account_file
+                )
+            return names
+
+    raise ValueError(f"Unknown storage backend: {CONFIG.storage_backend}")
+
+
+def create_partitioned_table[T](
+    model: T,
+    partition_col: str,
+    granularity: Granularity,
+    unique_cols: list[str] | None = None,
+    index_cols: list[str] | None = None,
+) -> PartitionedTable[T]:
+    """
+    設定で選択されたバックエンドに、日時ごとのパーティションに分けて保存するテーブルを生成する
+
+    パーティションは「モデル名-パーティション名」という名前のシート・テーブルとして保存される。
+    モデル名だけのシート・テーブルはパーティションに分ける前のものとして読み込まれる。
+
+    Args:
+        model (T): モデルとなるデータクラス
+        partition_col (str): パーティションを決める日時のフィールド名
+        granularity (Granularity): パーティションの単位
+        unique_cols (list[str] | None): get_by()で値から行を引くフィールド名のリスト
+        index_cols (list[str] | None): unique_cols以外にインデックスを張るフィールド名のリスト
+
+    Returns:
+        PartitionedTable[T]: テーブル
+    """
+    prefix = f"{model.__name__}-"
+
+    def open_partition(key: str, is_current: bool) -> Table[T]:
+        # 過去のパーティションはほとんど編集されないため、定期的な同期は行わない
+        return create_table(
+            model,
+            unique_cols,
+            index_cols,
+            name=f"{prefix}{key}" if key else model.__name__,
+            sync=is_current,
+        )
+
+    def list_partitions() -> list[str]:
+        return [
+            name.removeprefix(prefix) if name != model.__name__ else ""
+            for name in list_table_names()
+            if name.startswith(prefix) or name == model.__name__
+        ]
+
+    table = PartitionedTable(
+        model,
+        partition_col,
+        open_partition,
+        list_partitions,
+        granularity,
+        legacy_partition="",
+    )
+    table.open_current()
+    return table
+
+
+class DefaultTable[T](Table[T]):
+    """設定で選択されたバックエンドに処理を委ねるテーブル"""
+
+    def __init__(
+        self,
+        model: T,
+        unique_cols: list[str] | None = None,
+        index_cols: list[str] | None = None,
+        snapshot: bool = False,
+        partition_col: str | None = None,
+        granularity: Granularity = "month",
+    ):
+        """
+        Args:
+            model (T): モデルとなるデータクラス
+            unique_cols (list[str] | None): get_by()で値から行を引くフィールド名のリスト
+            index_cols (list[str] | None): unique_cols以外にインデックスを張るフィールド名のリスト
+            snapshot (bool): シートに接続できない場合に備えて、シートの内容をローカルに保存するかどうか
+            partition_col (str | None): 日時ごとのパーティションに分けて保存する場合、パーティションを決める日時のフィールド名
+            granularity (Granularity): パーティションの単位
+        """
+        if partition_col is None:
+            self._backend = create_table(model, unique_cols, index_cols, snapshot)
+        else:
+            self._backend = create_partitioned_table(
+                model, partition_col, granularity, unique_cols, index_cols
+            )
+        self._model = self._backend._model
+        self._index_col = self._backend._index_col
+
+    def subscribe(self, listener: ChangeListener):
+        self._backend.subscribe(listener)
+
+    def unsubscribe(self, listener: ChangeListener):
+        self._backend.unsubscribe(listener)
+
+    def get_all_as_df(self) -> pd.DataFrame:
+        return self._backend.get_all_as_df()
+
+    def get_all(self) -> list[T]:
+        return self._backend.get_all()
+
+    def get_by_index(self, index: str) -> T | None:
+        return self._backend.get_by_index(index)
+
+    def get_by(self, col: str, value: str) -> T | None:
+        return self._backend.get_by(col, value)
+
+    def update(self, rows: list[T], write: bool = True):
+        self._backend.update(rows, write)
+
+    def compare_and_set(self, expected: T | None, row: T, write: bool = True) -> bool:
+        return self._backend.compare_and_set(expected, row, write)
+
+    def compare_and_set_many(
+        self, pairs: list[tuple[T | None, T]], write: bool = True
+    ) -> list[bool]:
+        return self._backend.compare_and_set_many(pairs, write)
+
+    def apply_remote(self, rows: list[T]):
+        self._backend.apply_remote(rows)
+
+    def delete(self, indexes: list[str]):
+        self._backend.delete(indexes)
+
+    def flush(self):
+        self._backend.flush()
+
+    def has_pending(self) -> bool:
+        return self._backend.has_pending()
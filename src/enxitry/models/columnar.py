@@ -0,0 +1,196 @@
+import datetime
+import enum
+import functools
+import re
+from typing import Iterator, Sequence, get_origin
+
+import pandas as pd
+from loguru import logger
+from pydantic import BaseModel, TypeAdapter
+
+from enxitry.config import CONFIG
+
+
+UTC_OFFSET_PATTERN = re.compile(r"([+-])(\d{2}):(\d{2})")
+
+
+def parse_timestamps(timestamps: pd.Series) -> pd.Series:
+    """
+    タイムスタンプを設定されたタイムゾーンの日時に変換する
+
+    タイムゾーンを持たない日時は設定されたタイムゾーンの日時とみなす。
+    変換できない値はNaTになる。
+
+    Args:
+        timestamps (pd.Series): ISO 8601形式の文字列またはdatetime
+
+    Returns:
+        pd.Series: 設定されたタイムゾーンの日時
+    """
+    if timestamps.dtype.kind == "M":
+        if isinstance(timestamps.dtype, pd.DatetimeTZDtype):
+            return timestamps.dt.tz_convert(CONFIG.timezone)
+        return timestamps.dt.tz_localize(CONFIG.timezone)
+
+    # 時差の異なる文字列をまとめて変換すると遅いため、時差を切り離して変換する
+    timestamps = timestamps.astype(str)
+    offsets = timestamps.str.slice(-6)
+    deltas = {}
+    for offset in offsets.unique():
+        match = UTC_OFFSET_PATTERN.fullmatch(offset)
+        if match is None:
+            return _parse_timestamps_slow(timestamps)
+        sign = 1 if match[1] == "+" else -1
+        deltas[offset] = sign * pd.Timedelta(hours=int(match[2]), minutes=int(match[3]))
+
+    local = pd.to_datetime(
+        timestamps.str.slice(0, -6), format="ISO8601", errors="coerce"
+    )
+    return (
+        (local - offsets.map(deltas))
+        .dt.tz_localize("UTC")
+        .dt.tz_convert(CONFIG.timezone)
+    )
+
+
+def _parse_timestamps_slow(timestamps: pd.Series) -> pd.Series:
+    """
+    時差の書式がそろっていないタイムスタンプを1つずつ変換する。
+
+    Args:
+        timestamps (pd.Series): ISO 8601形式の文字列
+
+    Returns:
+        pd.Series: 設定されたタイムゾーンの日時
+    """
+
+    def parse(value: str) -> pd.Timestamp:
+        try:
+            timestamp = pd.Timestamp(value)
+        except ValueError:
+            return pd.NaT
+        if timestamp.tzinfo is None:
+            return timestamp.tz_localize(CONFIG.timezone)
+        return timestamp.tz_convert(CONFIG.timezone)
+
+    return pd.Series(
+        pd.DatetimeIndex(timestamps.map(parse), tz=CONFIG.timezone),
+        index=timestamps.index,
+    )
+
+
+def coerce_df(model: type[BaseModel], df: pd.DataFrame) -> pd.DataFrame:
+    """
+    シートから読み込んだ文字列の列を、モデルのフィールドの型に列ごとまとめて変換する
+
+    列挙型のフィールドは値が列挙型に含まれるかを、日時のフィールドは日時として解釈できるかを検証する。
+    検証に失敗した行は取り除かれ、ログに記録される。
+
+    Args:
+        model (type[BaseModel]): モデル
+        df (pd.DataFrame): モデルの全てのフィールドを列に持つDataFrame
+
+    Returns:
+        pd.DataFrame: 変換した内容
+    """
+    columns = {}
+    is_valid = pd.Series(True, index=df.index)
+
+    for name, info in model.model_fields.items():
+        col = df[name]
+        annotation = info.annotation
+        if get_origin(annotation) is None and isinstance(annotation, type):
+            if issubclass(annotation, enum.Enum):
+                members = {member.value: member for member in annotation}
+                col = col.map(members)
+                is_valid &= col.notna()
+            elif issubclass(annotation, datetime.datetime):
+                col = parse_timestamps(col)
+                is_valid &= col.notna()
+            elif issubclass(annotation, str):
+                is_valid &= col.notna()
+                col = col.astype(object)
+        columns[name] = col
+
+    coerced = pd.DataFrame(columns, index=df.index)
+    if not is_valid.all():
+        invalid = list(df.index[~is_valid])
+        logger.warning(
+            f"Skipping {len(invalid)} invalid {model.__name__} rows: {invalid[:10]}"
+        )
+        coerced = coerced[is_valid]
+    return coerced
+
+
+class LazyModelList[T](Sequence[T]):
+    """
+    変換済みのDataFrameの行を、アクセスされた時点でモデルにするリスト
+
+    値はcoerce_df()で検証済みのため、モデルは検証を省いて作られる。
+    """
+
+    def __init__(self, model: type[T], df: pd.DataFrame):
+        """
+        Args:
+            model (type[T]): モデル
+            df (pd.DataFrame): coerce_df()で変換した、モデルの全てのフィールドを列に持つDataFrame
+        """
+        self._model = model
+        self._fields = list(model.model_fields)
+        self._columns = [df[name].to_numpy(dtype=object) for name in self._fields]
+        self._datetime_fields = {
+            i
+            for i, name in enumerate(self._fields)
+            if isinstance(df[name].dtype, pd.DatetimeTZDtype)
+        }
+
+    def __len__(self) -> int:
+        return len(self._columns[0]) if self._columns else 0
+
+    def _construct(self, position: int) -> T:
+        values = {}
+        for i, name in enumerate(self._fields):
+            value = self._columns[i][position]
+            if i in self._datetime_fields:
+                value = value.to_pydatetime()
+            values[name] = value
+        return self._model.model_construct(**values)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self._construct(i) for i in range(len(self))[position]]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return self._construct(position)
+
+    def __iter__(self) -> Iterator[T]:
+        for position in range(len(self)):
+            yield self._construct(position)
+
+
+@functools.cache
+def _list_adapter(model: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+
+def models_to_df(
+    model: type[BaseModel], rows: list[BaseModel], index_col: str
+) -> pd.DataFrame:
+    """
+    モデルのリストを、シートに書き込む形式のDataFrameにまとめて変換する
+
+    Args:
+        model (type[BaseModel]): モデル
+        rows (list[BaseModel]): 変換するモデル
+        index_col (str): インデックスとするフィールド名
+
+    Returns:
+        pd.DataFrame: インデックスとするフィールドをインデックスとし、値をJSONの形式にしたDataFrame。
+        同じインデックスの行が複数ある場合は最後の行が残る。
+    """
+    records = _list_adapter(model).dump_python(rows, mode="json")
+    df = pd.DataFrame.from_records(records, columns=list(model.model_fields))
+    df.set_index(index_col, inplace=True)
+    return df[~df.index.duplicated(keep="last")]
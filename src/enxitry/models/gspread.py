@@ -1,17 +1,51 @@
-from dataclasses import asdict
+import threading
+import time
 from pathlib import Path
+from typing import Callable
 
 import pandas as pd
 from pydantic import BaseModel
+from gspread.utils import rowcol_to_a1
 from gspread_pandas import Spread
 from gspread_pandas.conf import get_config
 from loguru import logger
 
+from enxitry import health
 from enxitry.config import CONFIG
+from .columnar import models_to_df
+from .table import RowChange, Table, diff_df
 
 
-class GSpreadTable[T]:
-    """Google Sheetsをデータベースとして利用するためのクラス"""
+def list_sheets(spread_url: str, service_account_file: Path) -> list[str]:
+    """
+    スプレッドシートに含まれるシート名を全て取得する
+
+    Args:
+        spread_url (str): スプレッドシートのURL
+        service_account_file (Path): サービスアカウントファイル
+
+    Returns:
+        list[str]: シート名
+    """
+    spread = Spread(
+        spread_url,
+        config=get_config(service_account_file.parent, service_account_file.name),
+    )
+    return [sheet.title for sheet in spread.sheets]
+
+
+class GSpreadTable[T](Table[T]):
+    """
+    Google Sheetsをデータベースとして利用するためのクラス
+
+    シートの内容はメモリ上にキャッシュされ、読み込みはキャッシュから行われる。
+    書き込みはキャッシュとシートの両方に反映され (write-through)、
+    シート側で直接編集された内容はバックグラウンドで定期的に取り込まれる。
+    シートへの書き込みを後回しにする場合、変更された行はflush()でまとめて書き込まれる。
+
+    シートに接続できない間もキャッシュへの読み書きは続けられ、
+    接続が回復した時点でシート側の変更とマージした上で書き込まれる。
+    """
 
     def __init__(
         self,
@@ -20,6 +54,9 @@ class GSpreadTable[T]:
         service_account_file: Path,
         sheet_name: str = "",
         index_col: str = "",
+        unique_cols: list[str] | None = None,
+        sync_interval: float | None = None,
+        snapshot_path: Path | None = None,
     ):
         """
         Args:
@@ -28,6 +65,9 @@ class GSpreadTable[T]:
             service_account_file (Path): サービスアカウントファイル
             sheet_name (str): シート名。空文字列の場合はモデル名が利用される。
             index_col (str): インデックスとするフィールド名。空文字列の場合はモデルの最初に定義されたフィールドが利用される。
+            unique_cols (list[str] | None): 値から行を引くためのハッシュインデックスを張るフィールド名のリスト
+            sync_interval (float | None): シートと同期する間隔 (秒)。Noneの場合は設定値が利用され、0以下の場合は同期しない。
+            snapshot_path (Path | None): シートの内容を保存するファイルのパス。起動時にシートを読み込めない場合はこのファイルから読み込まれる。
         """
 
         if sheet_name == "":
@@ -36,8 +76,13 @@ class GSpreadTable[T]:
         if index_col == "":
             index_col = list(model.model_fields)[0]
 
+        if sync_interval is None:
+            sync_interval = CONFIG.gsheets_sync_interval
+
         self._index_col = index_col
+        self._unique_cols = unique_cols or []
         self._model = model
+        self._listeners = []
 
         self._gspread_conf = get_config(
             service_account_file.parent, service_account_file.name
@@ -46,7 +91,32 @@ class GSpreadTable[T]:
         self._spread_url = spread_url
         self._sheet_name = sheet_name
 
-        self._open_spread()
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self._df: pd.DataFrame | None = None
+        self._indexes: dict[str, dict[str, str]] = {}
+        self._revision = 0
+        self._pending: dict[str, bool] = {}
+        self._base: dict[str, dict | None] = {}
+        self._guarded: set[str] = set()
+        self._conflicts: set[str] = set()
+        self._unpositioned: set[str] = set()
+        self._dirty = False
+        self._synced_at = 0.0
+        self._sync_interval = sync_interval
+        self._snapshot_path = snapshot_path
+        self._spread: Spread | None = None
+        self._online = False
+
+        try:
+            self.sync(force=True)
+        except Exception as e:
+            logger.error(f"Starting {sheet_name} offline: {e}")
+            self._set_df(self._load_snapshot())
+
+        if sync_interval > 0:
+            self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
+            self._sync_thread.start()
 
     def _open_spread(self):
         self._spread = Spread(
@@ -56,6 +126,67 @@ class GSpreadTable[T]:
             create_sheet=True,
         )
 
+    def _call_spread[R](self, action: str, func: Callable[[Spread], R]) -> R:
+        """
+        シートへの操作を再試行しながら行い、接続状態を記録する。
+
+        Args:
+            action (str): 操作の説明
+            func (Callable[[Spread], R]): 操作
+
+        Returns:
+            R: 操作の結果
+        """
+        error = None
+        for _ in range(CONFIG.gsheets_error_retries):
+            try:
+                if self._spread is None:
+                    self._open_spread()
+                result = func(self._spread)
+                break
+            except Exception as e:
+                logger.error(f"Failed to {action}: {e}")
+                error = e
+                self._spread = None
+        else:
+            self._online = False
+            health.report(f"gsheets/{self._sheet_name}", f"Failed to {action}: {error}")
+            raise Exception(f"Failed to {action}")
+
+        self._online = True
+        health.report(f"gsheets/{self._sheet_name}")
+        return result
+
+    def _load_snapshot(self) -> pd.DataFrame:
+        """
+        保存されたシートの内容を読み込む。
+
+        Returns:
+            pd.DataFrame: シートの内容。保存されていない場合は空のテーブル。
+        """
+        if self._snapshot_path is None or not self._snapshot_path.exists():
+            return self._model_df()
+        return pd.read_csv(
+            self._snapshot_path,
+            dtype=str,
+            keep_default_na=False,
+            index_col=self._index_col,
+        )
+
+    def _save_snapshot(self, df: pd.DataFrame):
+        """
+        シートの内容をファイルに保存する。
+
+        Args:
+            df (pd.DataFrame): シートの内容
+        """
+        if self._snapshot_path is None:
+            return
+        self._snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._snapshot_path.with_suffix(".tmp")
+        df.to_csv(tmp_path)
+        tmp_path.replace(self._snapshot_path)
+
     def _model_df(self) -> pd.DataFrame:
         """
         モデルのデータフレームを取得する。
@@ -68,42 +199,514 @@ class GSpreadTable[T]:
         df.set_index(self._index_col, inplace=True)
         return df
 
-    def get_all_as_df(self) -> pd.DataFrame:
+    def _read_sheet(self) -> pd.DataFrame:
         """
-        データベースの内容をDataFrameとして全て取得する。
+        シートの内容を読み込む。
 
         Returns:
-            pd.DataFrame: データベースの内容
+            pd.DataFrame: シートの内容
         """
-        df = None
-        for _ in range(CONFIG.gsheets_error_retries):
-            try:
-                df = self._spread.sheet_to_df()
-                break
-            except Exception as e:
-                logger.error(f"Failed to read sheet: {e}")
-                self._open_spread()
-
-        if df is None:
-            raise Exception("Failed to read sheet")
-
+        df = self._call_spread("read sheet", lambda spread: spread.sheet_to_df())
         if df.empty:
             df = self._model_df()
         return df
 
-    def get_all(self) -> list[T]:
+    def _write_sheet(self, df: pd.DataFrame, replace: bool = False):
         """
-        データベースの内容を全て取得する。
+        シートにDataFrameを書き込む。
+
+        Args:
+            df (pd.DataFrame): 書き込む内容
+            replace (bool): シートの内容を置き換えるかどうか
+        """
+        self._call_spread(
+            "write sheet", lambda spread: spread.df_to_sheet(df, replace=replace)
+        )
+
+    def _set_df(self, df: pd.DataFrame) -> list[RowChange]:
+        """
+        キャッシュを置き換え、ハッシュインデックスを再構築する。
+
+        Args:
+            df (pd.DataFrame): 新しいテーブルの内容
 
         Returns:
-            list[T]: データベースの内容
+            list[RowChange]: 置き換える前の内容からの変更
         """
-        df = self.get_all_as_df()
-        if df.empty:
-            return []
-        df.reset_index(inplace=True)
-        df = df.apply(lambda x: self._model(**x), axis=1)
-        return list(df)
+        with self._lock:
+            changes = [] if self._df is None else diff_df(self._df, df)
+            self._df = df
+            self._indexes = {
+                col: dict(zip(df[col], df.index)) for col in self._unique_cols
+            }
+        return changes
+
+    def _index_row(self, index: str, old: dict | None, new: dict | None):
+        """
+        1行分の変更をハッシュインデックスに反映する。
+
+        Args:
+            index (str): 行のインデックス
+            old (dict | None): 変更前の行。新規追加の場合はNone。
+            new (dict | None): 変更後の行。削除の場合はNone。
+        """
+        for col in self._unique_cols:
+            values = self._indexes[col]
+            if old is not None and values.get(old[col]) == index:
+                del values[old[col]]
+            if new is not None:
+                values[new[col]] = index
+
+    def _keep_unpositioned(self, sheet_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        シートでの位置が分からない行のうち、まだシートに書き込まれていない行をシートの内容の末尾に残す。
+
+        シートに現れた行はシートでの位置を持つため、位置が分からない行から外れる。
+        self._lockを取得した状態で呼ぶ必要がある。
+
+        Args:
+            sheet_df (pd.DataFrame): シートの内容
+
+        Returns:
+            pd.DataFrame: シートの内容に、まだシートにない行を加えたもの
+        """
+        missing = [
+            index
+            for index in self._unpositioned
+            if index not in sheet_df.index and index in self._df.index
+        ]
+        self._unpositioned = set(missing)
+        if not missing:
+            return sheet_df
+        return pd.concat([sheet_df, self._df.loc[missing]])
+
+    def _write_rows(self, requests: list[dict]):
+        """
+        行単位の変更をまとめてシートへ書き込む。
+
+        Args:
+            requests (list[dict]): Sheets APIのbatchUpdateリクエストのリスト
+        """
+        if not requests:
+            return
+
+        self._call_spread(
+            "write rows",
+            lambda spread: spread.spread.batch_update({"requests": requests}),
+        )
+
+    def _row_data(self, df: pd.DataFrame, index: str, row: dict) -> dict:
+        """
+        1行分のデータをSheets APIのRowData形式に変換する。
+
+        Args:
+            df (pd.DataFrame): 列の並びを決めるテーブル
+            index (str): 行のインデックス
+            row (dict): 行の内容
+
+        Returns:
+            dict: RowData
+        """
+        values = [index] + [row[col] for col in df.columns]
+        return {
+            "values": [
+                {"userEnteredValue": {"stringValue": str(value)}} for value in values
+            ]
+        }
+
+    def _build_requests(self, pending: dict[str, bool]) -> list[dict]:
+        """
+        書き込み待ちの行からbatchUpdateリクエストを組み立てる。
+
+        Args:
+            pending (dict[str, bool]): 書き込み待ちの行のインデックスと、シートに未追加の行かどうか
+
+        Returns:
+            list[dict]: batchUpdateリクエストのリスト
+        """
+        sheet_id = self._spread.sheet.id
+        df = self._df
+
+        requests = [
+            {
+                "updateCells": {
+                    "start": {
+                        "sheetId": sheet_id,
+                        # 0行目はヘッダ
+                        "rowIndex": df.index.get_loc(index) + 1,
+                        "columnIndex": 0,
+                    },
+                    "rows": [self._row_data(df, index, df.loc[index].to_dict())],
+                    "fields": "userEnteredValue",
+                }
+            }
+            for index, is_new in pending.items()
+            if not is_new
+        ]
+
+        # 新しい行はキャッシュの末尾に追加された順に並んでいる
+        appended = [index for index, is_new in pending.items() if is_new]
+        if appended:
+            requests.append(
+                {
+                    "appendCells": {
+                        "sheetId": sheet_id,
+                        "rows": [
+                            self._row_data(df, index, df.loc[index].to_dict())
+                            for index in appended
+                        ],
+                        "fields": "userEnteredValue",
+                    }
+                }
+            )
+
+        return requests
+
+    def _reconcile(self, sheet_df: pd.DataFrame):
+        """
+        シートの内容と書き込み待ちの変更をマージし、キャッシュを置き換える。
+
+        ローカルで変更されていないフィールドはシートの値が、変更されたフィールドはローカルの値が採用される。
+        同じフィールドが両方で変更されていた場合はローカルの値が優先される。
+
+        Args:
+            sheet_df (pd.DataFrame): シートの内容
+        """
+        with self._lock:
+            df = self._keep_unpositioned(sheet_df).copy()
+            pending = {}
+            for index in self._pending:
+                local = self._df.loc[index].to_dict()
+                base = self._base.get(index)
+
+                # まだシートに書き込まれていない他のノードの行とは比べられない
+                if index in self._guarded and index not in self._unpositioned:
+                    remote = df.loc[index].to_dict() if index in df.index else None
+                    if remote != base:
+                        # compare_and_setで書き込んだ行はマージせず、シートの内容を採用する
+                        self._discard_conflict(index)
+                        continue
+
+                if index not in df.index:
+                    if base is not None:
+                        logger.warning(
+                            f"Row {index} was deleted from sheet {self._sheet_name}, restoring it"
+                        )
+                    df.loc[index] = local
+                    pending[index] = True
+                    self._base[index] = None
+                    continue
+
+                remote = df.loc[index].to_dict()
+                merged = {}
+                for col, value in local.items():
+                    remote_value = remote.get(col, value)
+                    base_value = None if base is None else base.get(col)
+                    if base is not None and value == base_value:
+                        merged[col] = remote_value
+                        continue
+                    if remote_value not in (value, base_value):
+                        logger.warning(
+                            f"Conflict on {col} of row {index} in sheet {self._sheet_name}: "
+                            f"keeping {value!r} over {remote_value!r}"
+                        )
+                    merged[col] = value
+
+                df.loc[index] = merged
+                pending[index] = False
+                self._base[index] = remote
+
+            changes = self._set_df(df)
+            self._pending = pending
+            # シートにヘッダが書かれていない可能性がある
+            self._dirty = sheet_df.empty
+            self._revision += 1
+
+        self._notify(changes)
+
+    def _reconcile_if_offline(self):
+        """
+        シートに接続できていなかった場合、シートを読み込んで書き込み待ちの変更とマージする。
+
+        シートの行の位置はキャッシュと一致しなくなっている可能性があるため、書き込みの前に行う必要がある。
+        """
+        if self._online:
+            return
+
+        sheet_df = self._read_sheet()
+        self._reconcile(sheet_df)
+        logger.info(f"Reconciled sheet {self._sheet_name} with local changes")
+
+    def _read_index_column(self) -> list[str]:
+        """
+        シートのインデックスの列を読み込む。
+
+        Returns:
+            list[str]: インデックスの列の値。0番目はヘッダ。
+        """
+        return self._call_spread(
+            "read index column", lambda spread: spread.sheet.col_values(1)
+        )
+
+    def _reconcile_if_moved(self, indexes: list[str], ids: list[str] | None = None):
+        """
+        書き込む行のシートでの位置がキャッシュと一致するかを確かめ、一致しない場合はシートを読み込んでマージする。
+
+        シートで行が直接削除・挿入・並べ替えられていると、キャッシュでの位置に書き込んだ際に別の行を上書きしてしまう。
+        確認にはインデックスの列だけを読み込む。
+        他のノードから受け取った位置の分からない行は、シートに現れていればマージによって位置が決まる。
+
+        Args:
+            indexes (list[str]): 位置を指定して書き込む行のインデックス
+            ids (list[str] | None): 読み込み済みのインデックスの列。Noneの場合は読み込む。
+        """
+        with self._lock:
+            positions = {
+                index: self._df.index.get_loc(index)
+                for index in indexes
+                if index in self._df.index
+            }
+        if not positions:
+            return
+
+        if ids is None:
+            ids = self._read_index_column()
+        present = set(ids)
+        with self._lock:
+            # まだシートに書き込まれていない行は、書き込まれるまで位置を決められない
+            waiting = {index for index in self._unpositioned if index not in present}
+        # 0行目はヘッダ
+        if all(
+            index in waiting or (position + 1 < len(ids) and ids[position + 1] == index)
+            for index, position in positions.items()
+        ):
+            with self._lock:
+                # キャッシュと同じ位置でシートに現れた行は、その位置に書き込める
+                self._unpositioned -= positions.keys() - waiting
+            return
+
+        logger.warning(
+            f"Rows of sheet {self._sheet_name} have moved, reconciling with local changes"
+        )
+        self._reconcile(self._read_sheet())
+
+    def _discard_conflict(self, index: str):
+        """
+        他の書き込みと競合した行を書き込み待ちから外し、競合として記録する。self._lockを取得した状態で呼ぶ必要がある。
+
+        Args:
+            index (str): 行のインデックス
+        """
+        logger.warning(
+            f"Row {index} of sheet {self._sheet_name} was changed by another writer, "
+            "discarding local change"
+        )
+        self._pending.pop(index, None)
+        self._base.pop(index, None)
+        self._guarded.discard(index)
+        self._conflicts.add(index)
+
+    def _check_conflicts(self, indexes: list[str], ids: list[str]):
+        """
+        compare_and_setで書き込む行について、シートの現在の行が変更前の行と一致するかを確かめる。
+
+        一致しない行は他の端末やシートの直接編集と競合しているため、シートの内容をキャッシュに反映し、書き込みを取りやめる。
+        確認には対象の行だけを読み込む。
+
+        Args:
+            indexes (list[str]): 確かめる行のインデックス
+            ids (list[str]): 読み込み済みのインデックスの列
+        """
+        with self._lock:
+            columns = list(self._df.columns)
+
+        # 0行目はヘッダ
+        positions = {index: row for row, index in enumerate(ids, 1) if row > 1}
+        found = [index for index in indexes if index in positions]
+        ranges = [
+            f"{rowcol_to_a1(positions[index], 1)}:"
+            f"{rowcol_to_a1(positions[index], len(columns) + 1)}"
+            for index in found
+        ]
+        values = (
+            self._call_spread(
+                "read rows", lambda spread: spread.sheet.batch_get(ranges)
+            )
+            if ranges
+            else []
+        )
+
+        remotes: dict[str, dict | None] = {index: None for index in indexes}
+        for index, value_range in zip(found, values):
+            # 末尾の空のセルは返されない
+            cells = list(value_range[0]) if value_range else []
+            cells += [""] * (len(columns) + 1 - len(cells))
+            remotes[index] = dict(zip(columns, cells[1:]))
+
+        changes = []
+        with self._lock:
+            df = None
+            for index, remote in remotes.items():
+                if index not in self._guarded or remote == self._base.get(index):
+                    continue
+                # 他のノードがまだシートに書き込んでいない行とは比べられない
+                if remote is None and index in self._unpositioned:
+                    continue
+                if df is None:
+                    df = self._df.copy()
+                local = df.loc[index].to_dict()
+                if remote is None:
+                    df.drop(index, inplace=True)
+                else:
+                    df.loc[index] = remote
+                changes.append(RowChange(index, local, remote))
+                self._index_row(index, local, remote)
+                self._discard_conflict(index)
+            if df is not None:
+                self._df = df
+                self._revision += 1
+
+        self._notify(changes)
+
+    def flush(self):
+        """
+        書き込み待ちの変更をシートへ書き込む。
+
+        行単位の変更は1回のbatchUpdateにまとめて書き込まれる。
+        compare_and_setで書き込んだ行は、書き込む直前にシートの行が変更前の行と一致するかを確かめ、
+        一致しない場合は書き込まずにシートの内容を採用する。
+        書き込みに失敗した場合、変更は書き込み待ちのまま残る。
+        """
+        with self._write_lock:
+            if not self.has_pending():
+                return
+
+            self._conflicts = set()
+            self._reconcile_if_offline()
+
+            with self._lock:
+                guarded = [index for index in self._pending if index in self._guarded]
+            ids = self._read_index_column() if guarded else None
+            if guarded:
+                self._check_conflicts(guarded, ids)
+
+            with self._lock:
+                # シート全体を書き換える場合は位置を確かめる必要がない
+                targets = (
+                    []
+                    if self._dirty
+                    else [
+                        index for index, is_new in self._pending.items() if not is_new
+                    ]
+                )
+            self._reconcile_if_moved(targets, ids)
+
+            with self._lock:
+                dirty = self._dirty
+                # 位置の分からない行は、他のノードがシートに書き込んで位置が決まるまで書き込みを待つ
+                waiting = {
+                    index: is_new
+                    for index, is_new in self._pending.items()
+                    if index in self._unpositioned
+                }
+                pending = {
+                    index: is_new
+                    for index, is_new in self._pending.items()
+                    if index not in waiting
+                }
+                guarded = self._guarded - waiting.keys()
+                flushed = {index: self._df.loc[index].to_dict() for index in pending}
+                if dirty:
+                    df = self._df.drop(list(self._unpositioned))
+                else:
+                    requests = self._build_requests(pending)
+                self._pending = waiting
+                self._guarded -= guarded
+                self._dirty = False
+
+            try:
+                if dirty:
+                    self._write_sheet(df, replace=True)
+                else:
+                    self._write_rows(requests)
+            except Exception:
+                with self._lock:
+                    self._dirty = self._dirty or dirty
+                    merged = dict(pending)
+                    for index, is_new in self._pending.items():
+                        merged[index] = merged.get(index, False) or is_new
+                    self._pending = merged
+                    self._guarded |= guarded
+                raise
+
+            with self._lock:
+                for index in pending:
+                    if index in self._pending:
+                        # 書き込み中に再び変更された行は、書き込んだ内容を基準とする
+                        self._base[index] = flushed[index]
+                    else:
+                        self._base.pop(index, None)
+
+    def has_pending(self) -> bool:
+        """
+        シートへの書き込み待ちの変更があるかどうか
+
+        Returns:
+            bool: 書き込み待ちの変更がある場合はTrue
+        """
+        with self._lock:
+            return self._dirty or bool(self._pending)
+
+    def sync(self, force: bool = False):
+        """
+        キャッシュとシートを同期する。
+
+        キャッシュがシートへ書き込めていない変更を持つ場合はシートへ書き込み、
+        そうでない場合はシートの内容でキャッシュを置き換える。
+
+        Args:
+            force (bool): 前回の同期からの経過時間に関わらず同期するかどうか
+        """
+        if not force and time.time() - self._synced_at < self._sync_interval:
+            return
+
+        if self.has_pending():
+            self.flush()
+        else:
+            with self._lock:
+                revision = self._revision
+
+            df = self._read_sheet()
+
+            changes = []
+            with self._lock:
+                # 読み込み中に書き込まれた変更を上書きしないようにする
+                if self._revision == revision:
+                    changes = self._set_df(self._keep_unpositioned(df))
+            self._notify(changes)
+
+            self._save_snapshot(df)
+
+        with self._lock:
+            self._synced_at = time.time()
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self._sync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Failed to sync sheet {self._sheet_name}: {e}")
+
+    def get_all_as_df(self) -> pd.DataFrame:
+        """
+        データベースの内容をDataFrameとして全て取得する。
+
+        Returns:
+            pd.DataFrame: データベースの内容
+        """
+        with self._lock:
+            return self._df.copy()
 
     def get_by_index(self, index: str) -> T | None:
         """
@@ -115,51 +718,266 @@ class GSpreadTable[T]:
         Returns:
             T | None: インデックスに対応するデータベースの内容。見つからない場合は None。
         """
-        df = self.get_all_as_df()
-        row = df[df[self._index_col] == index]
-        if row.empty:
-            return None
-        return self._model(**row)
+        with self._lock:
+            if index not in self._df.index:
+                return None
+            row = self._df.loc[index].to_dict()
+        return self._model(**{self._index_col: index, **row})
+
+    def get_by(self, col: str, value: str) -> T | None:
+        """
+        ハッシュインデックスを張ったフィールドの値からデータを取得する。
 
-    def update(self, rows: list[T]):
+        Args:
+            col (str): フィールド名。unique_colsに含まれている必要がある。
+            value (str): フィールドの値
+
+        Returns:
+            T | None: 値に対応するデータベースの内容。見つからない場合は None。
+        """
+        with self._lock:
+            index = self._indexes[col].get(value)
+            if index is None:
+                return None
+            return self.get_by_index(index)
+
+    def _update_cache(self, rows: list[T]) -> list[RowChange]:
+        """
+        キャッシュの内容を更新し、シートへの書き込み待ちにする。変更の通知は行わない。
+
+        Args:
+            rows (list[T]): 更新するデータ
+
+        Returns:
+            list[RowChange]: キャッシュへの変更
+        """
+        with self._lock:
+            df = self._df.copy()
+            # シートにヘッダが書かれていない可能性があるため、空のテーブルへの書き込みはシート全体を書き換える
+            if df.empty:
+                self._dirty = True
+
+            # 行ごとにlocで代入せず、既存の行はまとめて書き換え、新しい行は1回のconcatで追記する
+            new_df = models_to_df(self._model, rows, self._index_col)
+            is_existing = new_df.index.isin(df.index)
+            existing = new_df.index[is_existing]
+            olds = df.loc[existing].to_dict("index")
+            if is_existing.any():
+                df.loc[existing, new_df.columns] = new_df[is_existing]
+            if not is_existing.all():
+                added = new_df[~is_existing]
+                df = pd.concat([df, added]) if not df.empty else added.copy()
+
+            changes = []
+            for index, row_dict in new_df.to_dict("index").items():
+                old = olds.get(index)
+                changes.append(RowChange(index, old, row_dict, local=True))
+                self._index_row(index, old, row_dict)
+                self._base.setdefault(index, old)
+                self._pending[index] = self._pending.get(index, False) or old is None
+
+            self._df = df
+            self._revision += 1
+
+        return changes
+
+    def update(self, rows: list[T], write: bool = True):
         """
         データベースの内容を更新する。データのインデックスが存在しない場合は新規追加する。
 
+        既存の行は該当する範囲のみを書き換え、新しい行はシートの末尾に追記する。
+
         Args:
             rows (T | list[T]): 更新するデータ
+            write (bool): すぐにシートへ書き込むかどうか。Falseの場合はキャッシュのみを更新し、シートへはflush()で書き込む。
         """
-        df = self.get_all_as_df()
-        for row in rows:
-            row_dict = row.model_dump()
-            index = row.__getattribute__(self._index_col)
-            df.loc[index] = row_dict
+        self._notify(self._update_cache(rows))
 
-        for _ in range(CONFIG.gsheets_error_retries):
-            try:
-                self._spread.df_to_sheet(df)
+        if write:
+            self.flush()
+
+    def apply_remote(self, rows: list[T]):
+        """
+        他のノードで書き込まれた行をキャッシュに反映する。シートへの書き込みは行わない。
+
+        書き込み待ちの行はこのノードの変更が優先され、シートへの書き込みの際にマージされる。
+        キャッシュにない行はシートでの位置が分からないため、位置の分からない行としてキャッシュの末尾に追加する。
+        これらの行はシートへ書き込まれず、シートに現れた時点で同期やマージによって位置が決まる。
+
+        Args:
+            rows (list[T]): 他のノードで書き込まれた行
+        """
+        new_df = models_to_df(self._model, rows, self._index_col)
+        with self._lock:
+            new_df = new_df[~new_df.index.isin(list(self._pending))]
+            if new_df.empty:
                 return
-            except Exception as e:
-                logger.error(f"Failed to write sheet: {e}")
-                self._open_spread()
 
-        raise Exception("Failed to write sheet")
+            df = self._df.copy()
+            is_existing = new_df.index.isin(df.index)
+            existing = new_df[is_existing]
+            added = new_df[~is_existing]
+            olds = df.loc[existing.index].to_dict("index")
+            if not existing.empty:
+                df.loc[existing.index, existing.columns] = existing
+            if not added.empty:
+                df = pd.concat([df, added]) if not df.empty else added.copy()
+                self._unpositioned.update(added.index)
+
+            changes = []
+            for index, row_dict in new_df.to_dict("index").items():
+                old = olds.get(index)
+                if old != row_dict:
+                    changes.append(RowChange(index, old, row_dict))
+                    self._index_row(index, old, row_dict)
+            self._df = df
+            # 読み込み中のシートの内容で上書きしないようにする
+            self._revision += 1
+
+        self._notify(changes)
+
+    def compare_and_set(self, expected: T | None, row: T, write: bool = True) -> bool:
+        """
+        現在の行がexpectedと一致する場合に限り、行を更新する。
+
+        まずキャッシュと比較した上で、シートに接続できている間はwriteに関わらずすぐにシートへ書き込む。
+        書き込む直前にシートの行を読み直し、キャッシュの変更前の行と一致しない場合は
+        他の端末やシートの直接編集と競合したとみなし、シートの内容をキャッシュに反映してFalseを返す。
+        Sheets APIは条件付きの書き込みを持たないため、読み直しから書き込みまでの間の競合は検出できない。
+
+        シートに接続できない間はキャッシュとの比較のみを行い、行は書き込み待ちとなる。
+        その場合の競合は次にシートへ書き込む際に検出され、シートの内容が採用される。
+        変更の通知は競合しなかった場合にのみ行われる。
+
+        Args:
+            expected (T | None): 読み込んだ時点の行。行が存在しないことを期待する場合はNone。
+            row (T): 更新後の行
+            write (bool): すぐにシートへ書き込むかどうか。Trueの場合、書き込みに失敗すると例外が送出される。
+
+        Returns:
+            bool: 更新した場合はTrue、他の書き込みと競合した場合はFalse
+        """
+        return self.compare_and_set_many([(expected, row)], write)[0]
+
+    def compare_and_set_many(
+        self, pairs: list[tuple[T | None, T]], write: bool = True
+    ) -> list[bool]:
+        """
+        複数の行について、現在の行がexpectedと一致する場合に限り行を更新する。
+
+        全ての行の比較は1つのロックの中で行われ、一致した行は1回のbatchUpdateでシートへ書き込まれる。
+        競合の検出はcompare_and_set()と同様に行われる。
+
+        Args:
+            pairs (list[tuple[T | None, T]]): 読み込んだ時点の行と更新後の行の組のリスト
+            write (bool): すぐにシートへ書き込むかどうか。Trueの場合、書き込みに失敗すると例外が送出される。
+
+        Returns:
+            list[bool]: 組ごとの、更新した場合はTrue、他の書き込みと競合した場合はFalse
+        """
+        with self._write_lock:
+            with self._lock:
+                results = []
+                rows = {}
+                for expected, row in pairs:
+                    index = getattr(row, self._index_col)
+                    # 同じ行の2つ目以降の組は、1つ目の書き込みと競合したものとみなす
+                    results.append(
+                        index not in rows and self.get_by_index(index) == expected
+                    )
+                    if results[-1]:
+                        rows[index] = row
+                if not rows:
+                    return results
+                changes = self._update_cache(list(rows.values()))
+                self._guarded.update(rows)
+                self._conflicts.difference_update(rows)
+
+            error = None
+            if write or self._online:
+                try:
+                    self.flush()
+                except Exception as e:
+                    error = e
+
+            results = [
+                result and getattr(row, self._index_col) not in self._conflicts
+                for result, (_, row) in zip(results, pairs)
+            ]
+            accepted = rows.keys() - self._conflicts
+
+        self._notify([change for change in changes if change.index in accepted])
+
+        if error is not None:
+            if write:
+                raise error
+            logger.warning(
+                f"{len(accepted)} rows of sheet {self._sheet_name} will be checked for conflicts on next flush: {error}"
+            )
+        return results
 
     def delete(self, indexes: list[str]):
         """
         インデックスに対応するデータを削除する。
 
+        書き込み待ちの変更を先に書き込んだ上で、削除はすぐにシートへ書き込まれる。
+
         Args:
             indexes (list[str]): 削除するデータのインデックス
         """
-        df = self.get_all_as_df()
-        df.drop(indexes, inplace=True)
+        with self._write_lock:
+            self.flush()
+            self._reconcile_if_offline()
+            self._reconcile_if_moved(indexes)
 
-        for _ in range(CONFIG.gsheets_error_retries):
-            try:
-                self._spread.df_to_sheet(df, replace=True)
-                return
-            except Exception as e:
-                logger.error(f"Failed to write sheet: {e}")
-                self._open_spread()
+            with self._lock:
+                df = self._df.copy()
+                # シートで既に削除されていた行は、マージによってキャッシュからも消えている
+                indexes = [index for index in indexes if index in df.index]
+
+                # 後ろの行から削除することで、前の行の位置がずれないようにする。
+                # まだシートに書き込まれていない行はキャッシュからのみ削除する
+                sheet_id = self._spread.sheet.id
+                positions = sorted(
+                    {
+                        df.index.get_loc(index)
+                        for index in indexes
+                        if index not in self._unpositioned
+                    },
+                    reverse=True,
+                )
+                requests = [
+                    {
+                        "deleteDimension": {
+                            "range": {
+                                "sheetId": sheet_id,
+                                "dimension": "ROWS",
+                                "startIndex": position + 1,
+                                "endIndex": position + 2,
+                            }
+                        }
+                    }
+                    for position in positions
+                ]
+
+                changes = [
+                    RowChange(index, df.loc[index].to_dict(), None, local=True)
+                    for index in indexes
+                ]
+                for index, old, _, _ in changes:
+                    self._index_row(index, old, None)
+                    self._base.pop(index, None)
+                    self._unpositioned.discard(index)
+                df.drop(indexes, inplace=True)
 
-        raise Exception("Failed to write sheet")
+                self._df = df
+                self._revision += 1
+
+            self._notify(changes)
+
+            try:
+                self._write_rows(requests)
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                raise
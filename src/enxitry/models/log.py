@@ -1,13 +1,14 @@
 import datetime
 from enum import StrEnum
-from typing import Self, Callable
+from typing import Iterator, Self, Callable
 
 from cuid2 import cuid_wrapper
+import pandas as pd
 from pydantic import BaseModel
 import pytz
 
 from enxitry.config import CONFIG
-from .gspread import GSpreadTable
+from .backend import DefaultTable
 
 
 cuid2 = cuid_wrapper()
@@ -60,7 +61,7 @@ class Log(BaseModel):
         )
 
 
-class DefaultLogTable(GSpreadTable[Log]):
+class DefaultLogTable(DefaultTable[Log]):
     """ログのデータベース。シングルトン。"""
 
     def __new__(cls, *args, **kargs):
@@ -69,10 +70,35 @@ class DefaultLogTable(GSpreadTable[Log]):
             super().__init__(
                 cls._instance,
                 Log,
-                CONFIG.gsheets_url,
-                CONFIG.gsheets_service_account_file,
+                index_cols=["timestamp", "student_id"],
+                partition_col="timestamp",
+                granularity=CONFIG.log_partition,
             )
         return cls._instance
 
     def __init__(self):
         pass
+
+    def get_between(
+        self, start: datetime.datetime, end: datetime.datetime
+    ) -> pd.DataFrame:
+        """
+        期間内に記録されたログを取得する。期間に重なるパーティションだけが読み込まれる。
+
+        Args:
+            start (datetime.datetime): 期間の始まり (この日時を含む)
+            end (datetime.datetime): 期間の終わり (この日時を含まない)
+
+        Returns:
+            pd.DataFrame: ログ
+        """
+        return self._backend.get_between(start, end)
+
+    def iter_partitions(self) -> Iterator[pd.DataFrame]:
+        """
+        ログをパーティションごとに古い順に取得する。
+
+        Yields:
+            pd.DataFrame: 1つのパーティションに含まれるログ
+        """
+        return self._backend.iter_partitions()
@@ -0,0 +1,306 @@
+import datetime
+import threading
+from typing import Callable, Iterator, Literal
+
+import pandas as pd
+import pytz
+from loguru import logger
+
+from enxitry.config import CONFIG
+from .table import Table
+
+
+type Granularity = Literal["month", "term"]
+
+
+def to_local(timestamp: datetime.datetime) -> datetime.datetime:
+    """
+    日時を設定されたタイムゾーンの日時に変換する。タイムゾーンを持たない日時は設定されたタイムゾーンの日時とみなす。
+
+    Args:
+        timestamp (datetime.datetime): 日時
+
+    Returns:
+        datetime.datetime: 設定されたタイムゾーンの日時
+    """
+    tz = pytz.timezone(CONFIG.timezone)
+    if timestamp.tzinfo is None:
+        return tz.localize(timestamp)
+    return timestamp.astimezone(tz)
+
+
+def get_partition_key(timestamp: datetime.datetime, granularity: Granularity) -> str:
+    """
+    日時が属するパーティションの名前を求める
+
+    Args:
+        timestamp (datetime.datetime): 日時
+        granularity (Granularity): パーティションの単位。"month"は月ごと、"term"は4月と10月に始まる学期ごと。
+
+    Returns:
+        str: パーティションの名前。"2024-05"や"2024T1"のような形式。
+    """
+    local = to_local(timestamp)
+    match granularity:
+        case "month":
+            return f"{local.year:04d}-{local.month:02d}"
+        case "term":
+            # 学年は4月に始まるため、1月から3月は前の年の後期になる
+            year = local.year if local.month >= 4 else local.year - 1
+            term = 1 if 4 <= local.month < 10 else 2
+            return f"{year:04d}T{term}"
+
+    raise ValueError(f"Unknown partition granularity: {granularity}")
+
+
+def get_partition_keys_between(
+    start: datetime.datetime, end: datetime.datetime, granularity: Granularity
+) -> list[str]:
+    """
+    期間に含まれる全てのパーティションの名前を求める
+
+    Args:
+        start (datetime.datetime): 期間の始まり
+        end (datetime.datetime): 期間の終わり
+        granularity (Granularity): パーティションの単位
+
+    Returns:
+        list[str]: 古い順に並んだパーティションの名前
+    """
+    start, end = to_local(start), to_local(end)
+    year, month = start.year, start.month
+
+    keys = []
+    while (year, month) <= (end.year, end.month):
+        key = get_partition_key(
+            start.replace(year=year, month=month, day=1), granularity
+        )
+        if not keys or keys[-1] != key:
+            keys.append(key)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return keys
+
+
+class PartitionedTable[T](Table[T]):
+    """
+    行を日時ごとのパーティションに分けて保存するテーブル
+
+    パーティションはそれぞれ別のテーブル (シートやSQLiteのテーブル) として保存され、
+    行の日時から決まるパーティションに書き込まれる。パーティションは必要になった時点で開かれ、
+    新しい月や学期の行が書き込まれると新しいパーティションが作られる。
+    パーティションに分ける前のテーブルが残っている場合、それも1つのパーティションとして読み込まれる。
+    """
+
+    def __init__(
+        self,
+        model: T,
+        time_col: str,
+        open_partition: Callable[[str, bool], Table[T]],
+        list_partitions: Callable[[], list[str]],
+        granularity: Granularity,
+        index_col: str = "",
+        legacy_partition: str | None = None,
+    ):
+        """
+        Args:
+            model (T): モデルとなるデータクラス。pydantic.BaseModelを継承している必要がある。
+            time_col (str): パーティションを決める日時のフィールド名
+            open_partition (Callable[[str, bool], Table[T]]): パーティションの名前と、それが現在のパーティションかどうかを受け取り、テーブルを開く関数
+            list_partitions (Callable[[], list[str]]): 保存されている全てのパーティションの名前を返す関数。パーティションに分ける前のテーブルが残っている場合はlegacy_partitionも含める。
+            granularity (Granularity): パーティションの単位
+            index_col (str): インデックスとするフィールド名。空文字列の場合はモデルの最初に定義されたフィールドが利用される。
+            legacy_partition (str | None): パーティションに分ける前のテーブルをパーティションとして扱う場合の名前
+        """
+        if index_col == "":
+            index_col = list(model.model_fields)[0]
+
+        self._model = model
+        self._index_col = index_col
+        self._time_col = time_col
+        self._open_partition = open_partition
+        self._list_partitions = list_partitions
+        self._granularity = granularity
+        self._legacy_partition = legacy_partition
+        self._listeners = []
+
+        self._lock = threading.RLock()
+        self._partitions: dict[str, Table[T]] = {}
+        self._listed: set[str] | None = None
+
+    def _current_key(self) -> str:
+        return get_partition_key(datetime.datetime.now(datetime.UTC), self._granularity)
+
+    def _get_partition(self, key: str) -> Table[T]:
+        """
+        パーティションを開く。既に開いている場合はそれを返す。
+
+        Args:
+            key (str): パーティションの名前
+
+        Returns:
+            Table[T]: パーティション
+        """
+        with self._lock:
+            if key not in self._partitions:
+                logger.info(f"Opening partition {key} of {self._model.__name__}")
+                partition = self._open_partition(key, key == self._current_key())
+                partition.subscribe(self._notify)
+                self._partitions[key] = partition
+            return self._partitions[key]
+
+    def open_current(self):
+        """
+        現在のパーティションを開いておく。
+
+        パーティションを開く際にはシートの読み込みなどが行われるため、
+        最初の書き込みを待たせないよう、起動時に呼んでおく。
+        """
+        self._get_partition(self._current_key())
+
+    def _all_keys(self) -> list[str]:
+        """
+        保存されている、または開いている全てのパーティションの名前を新しい順に求める。
+
+        Returns:
+            list[str]: パーティションの名前
+        """
+        # パーティションを作るのはこのテーブルだけなので、一覧は1度取得できれば十分
+        with self._lock:
+            if self._listed is None:
+                try:
+                    self._listed = set(self._list_partitions())
+                except Exception as e:
+                    logger.error(
+                        f"Failed to list partitions of {self._model.__name__}: {e}"
+                    )
+            keys = set(self._listed or ()) | set(self._partitions)
+
+        # パーティションに分ける前のテーブルには全期間の行が含まれ得るため、常に最後に探す
+        has_legacy = self._legacy_partition in keys
+        keys.discard(self._legacy_partition)
+        return sorted(keys, reverse=True) + (
+            [self._legacy_partition] if has_legacy else []
+        )
+
+    def _concat(self, keys: list[str]) -> pd.DataFrame:
+        dfs = [self._get_partition(key).get_all_as_df() for key in keys]
+        dfs = [df for df in dfs if not df.empty]
+        if not dfs:
+            return pd.DataFrame()
+        return pd.concat(dfs)
+
+    def get_all_as_df(self) -> pd.DataFrame:
+        return self._concat(self._all_keys())
+
+    def iter_partitions(self) -> Iterator[pd.DataFrame]:
+        """
+        パーティションの内容を1つずつ取得する。パーティションに分ける前のテーブルが最初に返され、以降は古い順に返される。
+
+        Yields:
+            pd.DataFrame: パーティションの内容
+        """
+        for key in reversed(self._all_keys()):
+            df = self._get_partition(key).get_all_as_df()
+            if not df.empty:
+                yield df
+
+    def get_between(
+        self, start: datetime.datetime, end: datetime.datetime
+    ) -> pd.DataFrame:
+        """
+        日時が期間に含まれる行を取得する。期間に重なるパーティションだけが開かれる。
+
+        Args:
+            start (datetime.datetime): 期間の始まり (この日時を含む)
+            end (datetime.datetime): 期間の終わり (この日時を含まない)
+
+        Returns:
+            pd.DataFrame: 期間に含まれる行
+        """
+        keys = set(get_partition_keys_between(start, end, self._granularity))
+        keys.add(self._legacy_partition)
+        df = self._concat([key for key in self._all_keys() if key in keys])
+        if df.empty:
+            return df
+
+        timestamps = pd.to_datetime(df[self._time_col], utc=True, format="ISO8601")
+        start = pd.Timestamp(to_local(start))
+        end = pd.Timestamp(to_local(end))
+        return df[(timestamps >= start) & (timestamps < end)]
+
+    def get_by_index(self, index: str) -> T | None:
+        # インデックスからはパーティションが分からないため、新しいパーティションから順に探す
+        for key in self._all_keys():
+            row = self._get_partition(key).get_by_index(index)
+            if row is not None:
+                return row
+        return None
+
+    def get_by(self, col: str, value: str) -> T | None:
+        for key in self._all_keys():
+            row = self._get_partition(key).get_by(col, value)
+            if row is not None:
+                return row
+        return None
+
+    def _group_by_partition(self, rows: list[T]) -> dict[str, list[T]]:
+        rows_by_key: dict[str, list[T]] = {}
+        for row in rows:
+            key = get_partition_key(getattr(row, self._time_col), self._granularity)
+            rows_by_key.setdefault(key, []).append(row)
+        return rows_by_key
+
+    def update(self, rows: list[T], write: bool = True):
+        for key, partition_rows in self._group_by_partition(rows).items():
+            self._get_partition(key).update(partition_rows, write)
+
+    def apply_remote(self, rows: list[T]):
+        for key, partition_rows in self._group_by_partition(rows).items():
+            self._get_partition(key).apply_remote(partition_rows)
+
+    def compare_and_set(self, expected: T | None, row: T, write: bool = True) -> bool:
+        key = get_partition_key(getattr(row, self._time_col), self._granularity)
+        return self._get_partition(key).compare_and_set(expected, row, write)
+
+    def compare_and_set_many(
+        self, pairs: list[tuple[T | None, T]], write: bool = True
+    ) -> list[bool]:
+        positions_by_key: dict[str, list[int]] = {}
+        for position, (_, row) in enumerate(pairs):
+            key = get_partition_key(getattr(row, self._time_col), self._granularity)
+            positions_by_key.setdefault(key, []).append(position)
+
+        results = [False] * len(pairs)
+        for key, positions in positions_by_key.items():
+            partition_results = self._get_partition(key).compare_and_set_many(
+                [pairs[position] for position in positions], write
+            )
+            for position, result in zip(positions, partition_results):
+                results[position] = result
+        return results
+
+    def delete(self, indexes: list[str]):
+        remaining = set(indexes)
+        for key in self._all_keys():
+            if not remaining:
+                break
+            partition = self._get_partition(key)
+            found = [
+                index
+                for index in remaining
+                if partition.get_by_index(index) is not None
+            ]
+            if found:
+                partition.delete(found)
+                remaining.difference_update(found)
+
+    def flush(self):
+        with self._lock:
+            partitions = list(self._partitions.values())
+        for partition in partitions:
+            partition.flush()
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            partitions = list(self._partitions.values())
+        return any(partition.has_pending() for partition in partitions)
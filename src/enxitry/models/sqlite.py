@@ -0,0 +1,278 @@
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from .columnar import models_to_df
+from .table import RowChange, Table
+
+
+def list_tables(path: Path) -> list[str]:
+    """
+    データベースに含まれるテーブル名を全て取得する
+
+    Args:
+        path (Path): データベースファイルのパス
+
+    Returns:
+        list[str]: テーブル名
+    """
+    if not path.exists():
+        return []
+    with closing(sqlite3.connect(path)) as conn:
+        cur = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return [row[0] for row in cur.fetchall()]
+
+
+class SQLiteTable[T](Table[T]):
+    """
+    SQLiteをデータベースとして利用するためのクラス
+
+    ミラーとなるテーブルを指定した場合、書き込みはミラーにも反映される。
+    """
+
+    def __init__(
+        self,
+        model: T,
+        path: Path,
+        table_name: str = "",
+        index_col: str = "",
+        unique_cols: list[str] | None = None,
+        index_cols: list[str] | None = None,
+        mirror: Table[T] | None = None,
+    ):
+        """
+        Args:
+            model (T): モデルとなるデータクラス。pydantic.BaseModelを継承している必要がある。
+            path (Path): データベースファイルのパス
+            table_name (str): テーブル名。空文字列の場合はモデル名が利用される。
+            index_col (str): インデックスとするフィールド名。空文字列の場合はモデルの最初に定義されたフィールドが利用される。
+            unique_cols (list[str] | None): get_by()で値から行を引くフィールド名のリスト
+            index_cols (list[str] | None): unique_cols以外にインデックスを張るフィールド名のリスト
+            mirror (Table[T] | None): 書き込みを反映するテーブル。空の状態で起動した場合はミラーの内容が取り込まれる。
+        """
+
+        if table_name == "":
+            table_name = model.__name__
+
+        if index_col == "":
+            index_col = list(model.model_fields)[0]
+
+        self._model = model
+        self._index_col = index_col
+        self._unique_cols = unique_cols or []
+        self._table_name = table_name
+        self._columns = list(model.model_fields)
+        self._mirror = mirror
+        self._listeners = []
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+
+        self._create_table(self._unique_cols + (index_cols or []))
+
+        if mirror is not None and self._is_empty():
+            df = mirror.get_all_as_df()
+            if not df.empty:
+                logger.info(f"Importing {len(df)} rows into {table_name} from mirror")
+                self._insert_df(df)
+
+    def _create_table(self, index_cols: list[str]):
+        columns = ", ".join(
+            f'"{col}" TEXT PRIMARY KEY' if col == self._index_col else f'"{col}" TEXT'
+            for col in self._columns
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self._table_name}" ({columns})'
+            )
+            for col in index_cols:
+                self._conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{self._table_name}_{col}" '
+                    f'ON "{self._table_name}" ("{col}")'
+                )
+
+    def _is_empty(self) -> bool:
+        with self._lock:
+            cur = self._conn.execute(f'SELECT 1 FROM "{self._table_name}" LIMIT 1')
+            return cur.fetchone() is None
+
+    def _insert_df(self, df: pd.DataFrame):
+        """
+        インデックスをインデックスとするフィールドとしたDataFrameの行を書き込む。
+
+        Args:
+            df (pd.DataFrame): 書き込む内容
+        """
+        df = df.reset_index()[self._columns]
+        placeholders = ", ".join("?" for _ in self._columns)
+        columns = ", ".join(f'"{col}"' for col in self._columns)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f'INSERT OR REPLACE INTO "{self._table_name}" ({columns}) '
+                f"VALUES ({placeholders})",
+                df.itertuples(index=False, name=None),
+            )
+
+    def _to_model(self, row: tuple) -> T:
+        return self._model(**dict(zip(self._columns, row)))
+
+    def _get_rows(self, indexes: list[str]) -> dict[str, dict]:
+        """
+        インデックスに対応する行をインデックスとするフィールドを除いた辞書として取得する。
+
+        Args:
+            indexes (list[str]): インデックス
+
+        Returns:
+            dict[str, dict]: インデックスと行の辞書。存在しない行は含まれない。
+        """
+        placeholders = ", ".join("?" for _ in indexes)
+        with self._lock:
+            cur = self._conn.execute(
+                f'SELECT * FROM "{self._table_name}" '
+                f'WHERE "{self._index_col}" IN ({placeholders})',
+                indexes,
+            )
+            rows = [dict(zip(self._columns, row)) for row in cur.fetchall()]
+        return {row.pop(self._index_col): row for row in rows}
+
+    def get_all_as_df(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql_query(
+                f'SELECT * FROM "{self._table_name}"',
+                self._conn,
+                index_col=self._index_col,
+            )
+
+    def get_by_index(self, index: str) -> T | None:
+        return self.get_by(self._index_col, index)
+
+    def get_by(self, col: str, value: str) -> T | None:
+        with self._lock:
+            cur = self._conn.execute(
+                f'SELECT * FROM "{self._table_name}" WHERE "{col}" = ? LIMIT 1',
+                (value,),
+            )
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return self._to_model(row)
+
+    def _upsert(self, rows: list[T], local: bool):
+        """
+        行をデータベースに書き込み、変更を通知する。ミラーには反映しない。
+
+        Args:
+            rows (list[T]): 書き込む行
+            local (bool): このノードでの書き込みかどうか
+        """
+        df = models_to_df(self._model, rows, self._index_col)
+        with self._lock:
+            olds = self._get_rows(list(df.index))
+            self._insert_df(df)
+
+        self._notify(
+            [
+                RowChange(index, olds.get(index), new, local)
+                for index, new in df.to_dict("index").items()
+            ]
+        )
+
+    def update(self, rows: list[T], write: bool = True):
+        self._upsert(rows, local=True)
+        if self._mirror is not None:
+            self._mirror.update(rows, write=write)
+
+    def apply_remote(self, rows: list[T]):
+        # 行はすでに他のノードがシートへ書き込んでいるため、ミラーもキャッシュだけを更新する
+        self._upsert(rows, local=False)
+        if self._mirror is not None:
+            self._mirror.apply_remote(rows)
+
+    def compare_and_set(self, expected: T | None, row: T, write: bool = True) -> bool:
+        """
+        現在の行がexpectedと一致する場合に限り、行を更新する。
+
+        比較と書き込みは1つのトランザクションで行われるため、
+        同じデータベースを開いている他のプロセスからの書き込みとも競合しない。
+
+        Args:
+            expected (T | None): 読み込んだ時点の行。行が存在しないことを期待する場合はNone。
+            row (T): 更新後の行
+            write (bool): ミラーのシートへすぐに書き込むかどうか
+
+        Returns:
+            bool: 更新した場合はTrue、他の書き込みと競合した場合はFalse
+        """
+        return self.compare_and_set_many([(expected, row)], write)[0]
+
+    def compare_and_set_many(
+        self, pairs: list[tuple[T | None, T]], write: bool = True
+    ) -> list[bool]:
+        """
+        複数の行について、現在の行がexpectedと一致する場合に限り行を更新する。
+
+        全ての行の比較と書き込みは1つのトランザクションで行われる。
+
+        Args:
+            pairs (list[tuple[T | None, T]]): 読み込んだ時点の行と更新後の行の組のリスト
+            write (bool): ミラーのシートへすぐに書き込むかどうか
+
+        Returns:
+            list[bool]: 組ごとの、更新した場合はTrue、他の書き込みと競合した場合はFalse
+        """
+        with self._lock:
+            # 比較から書き込みまでの間、他の接続からの書き込みを止める
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                currents = self._get_rows(
+                    [getattr(row, self._index_col) for _, row in pairs]
+                )
+                results = []
+                rows = {}
+                for expected, row in pairs:
+                    index = getattr(row, self._index_col)
+                    current = currents.get(index)
+                    if current is not None:
+                        current = self._model(**{self._index_col: index, **current})
+                    # 同じ行の2つ目以降の組は、1つ目の書き込みと競合したものとみなす
+                    results.append(index not in rows and current == expected)
+                    if results[-1]:
+                        rows[index] = row
+                if not rows:
+                    self._conn.rollback()
+                    return results
+                # update()の書き込みがこのトランザクションをコミットする
+                self.update(list(rows.values()), write)
+            except Exception:
+                self._conn.rollback()
+                raise
+        return results
+
+    def delete(self, indexes: list[str]):
+        with self._lock, self._conn:
+            olds = self._get_rows(indexes)
+            self._conn.executemany(
+                f'DELETE FROM "{self._table_name}" WHERE "{self._index_col}" = ?',
+                [(index,) for index in indexes],
+            )
+
+        self._notify(
+            [RowChange(index, old, None, local=True) for index, old in olds.items()]
+        )
+
+        if self._mirror is not None:
+            self._mirror.delete(indexes)
+
+    def flush(self):
+        if self._mirror is not None:
+            self._mirror.flush()
+
+    def has_pending(self) -> bool:
+        return self._mirror is not None and self._mirror.has_pending()
@@ -2,8 +2,7 @@ from enum import StrEnum
 
 from pydantic import BaseModel
 
-from enxitry.config import CONFIG
-from .gspread import GSpreadTable
+from .backend import DefaultTable
 
 
 class StudentStatus(StrEnum):
@@ -32,7 +31,7 @@ class Student(BaseModel):
     status: StudentStatus
 
 
-class DefaultStudentsTable(GSpreadTable[Student]):
+class DefaultStudentsTable(DefaultTable[Student]):
     """学生のデータベース。シングルトン。"""
 
     def __new__(cls, *args, **kargs):
@@ -41,8 +40,8 @@ class DefaultStudentsTable(GSpreadTable[Student]):
             super().__init__(
                 cls._instance,
                 Student,
-                CONFIG.gsheets_url,
-                CONFIG.gsheets_service_account_file,
+                unique_cols=["idm"],
+                snapshot=True,
             )
         return cls._instance
 
@@ -59,7 +58,4 @@ class DefaultStudentsTable(GSpreadTable[Student]):
         Returns:
             Student | None: 学生。見つからなかった場合はNone。
         """
-        for student in self.get_all():
-            if student.idm == idm:
-                return student
-        return None
+        return self.get_by("idm", idm)
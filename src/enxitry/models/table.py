@@ -0,0 +1,234 @@
+from abc import ABC, abstractmethod
+from typing import Callable, NamedTuple, Sequence
+
+import pandas as pd
+
+from .columnar import LazyModelList, coerce_df
+
+
+class RowChange(NamedTuple):
+    """
+    1行分の変更を表すタプル
+
+    Attributes:
+        index (str): 行のインデックス
+        old (dict | None): 変更前の行。新規追加の場合はNone。
+        new (dict | None): 変更後の行。削除の場合はNone。
+        local (bool): このノードでの書き込みによる変更かどうか。シートとの同期や他のノードから受け取った変更ではFalse。
+    """
+
+    index: str
+    old: dict | None
+    new: dict | None
+    local: bool = False
+
+
+type ChangeListener = Callable[[list[RowChange]], None]
+
+
+def diff_df(old: pd.DataFrame, new: pd.DataFrame) -> list[RowChange]:
+    """
+    2つのテーブルの差分を行単位で求める
+
+    Args:
+        old (pd.DataFrame): 変更前のテーブル
+        new (pd.DataFrame): 変更後のテーブル
+
+    Returns:
+        list[RowChange]: 変更された行
+    """
+    removed = old.index.difference(new.index)
+    added = new.index.difference(old.index)
+    common = old.index.intersection(new.index)
+
+    if set(old.columns) == set(new.columns):
+        old_common = old.loc[common, new.columns].fillna("")
+        new_common = new.loc[common].fillna("")
+        changed = common[(old_common != new_common).any(axis=1).to_numpy()]
+    else:
+        changed = common
+
+    return (
+        [RowChange(index, old.loc[index].to_dict(), None) for index in removed]
+        + [RowChange(index, None, new.loc[index].to_dict()) for index in added]
+        + [
+            RowChange(index, old.loc[index].to_dict(), new.loc[index].to_dict())
+            for index in changed
+        ]
+    )
+
+
+class Table[T](ABC):
+    """
+    データベースのテーブルを表す抽象クラス
+
+    行はpydantic.BaseModelを継承したモデルで表され、インデックスとするフィールドの値で一意に識別される。
+    内容が変更されると、subscribe()で登録されたリスナーに変更された行が通知される。
+    リスナーは変更を行ったスレッドから呼ばれるため、すぐに処理を返す必要がある。
+    """
+
+    _model: T
+    _index_col: str
+    _listeners: list[ChangeListener]
+
+    def subscribe(self, listener: ChangeListener):
+        """
+        内容の変更を通知するリスナーを登録する
+
+        Args:
+            listener (ChangeListener): 変更された行のリストを受け取る関数
+        """
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: ChangeListener):
+        """
+        リスナーの登録を解除する
+
+        Args:
+            listener (ChangeListener): 登録したリスナー
+        """
+        self._listeners.remove(listener)
+
+    def _notify(self, changes: list[RowChange]):
+        """
+        リスナーに変更を通知する
+
+        Args:
+            changes (list[RowChange]): 変更された行
+        """
+        if not changes:
+            return
+        for listener in list(self._listeners):
+            listener(changes)
+
+    @abstractmethod
+    def get_all_as_df(self) -> pd.DataFrame:
+        """
+        データベースの内容をDataFrameとして全て取得する。
+
+        Returns:
+            pd.DataFrame: データベースの内容
+        """
+
+    def get_all(self) -> Sequence[T]:
+        """
+        データベースの内容を全て取得する。
+
+        値は列ごとにまとめて検証され、モデルはアクセスされた行についてのみ作られる。
+
+        Returns:
+            Sequence[T]: データベースの内容
+        """
+        df = self.get_all_as_df()
+        if df.empty:
+            return []
+        df = df.reset_index(names=self._index_col)
+        return LazyModelList(self._model, coerce_df(self._model, df))
+
+    @abstractmethod
+    def get_by_index(self, index: str) -> T | None:
+        """
+        indexに対応するデータを取得する。
+
+        Args:
+            index (str): インデックス
+
+        Returns:
+            T | None: インデックスに対応するデータベースの内容。見つからない場合は None。
+        """
+
+    @abstractmethod
+    def get_by(self, col: str, value: str) -> T | None:
+        """
+        インデックスを張ったフィールドの値からデータを取得する。
+
+        Args:
+            col (str): フィールド名
+            value (str): フィールドの値
+
+        Returns:
+            T | None: 値に対応するデータベースの内容。見つからない場合は None。
+        """
+
+    @abstractmethod
+    def update(self, rows: list[T], write: bool = True):
+        """
+        データベースの内容を更新する。データのインデックスが存在しない場合は新規追加する。
+
+        Args:
+            rows (list[T]): 更新するデータ
+            write (bool): すぐに書き込むかどうか。Falseの場合、外部への書き込みはflush()まで後回しにされることがある。
+        """
+
+    def compare_and_set(self, expected: T | None, row: T, write: bool = True) -> bool:
+        """
+        現在の行がexpectedと一致する場合に限り、行を更新する。
+
+        読み込んでから書き込むまでの間に他の書き込みがあった場合、更新は行われずFalseが返る。
+        呼び出し側は行を読み直して再試行する。
+        既定の実装は比較と更新を不可分に行わないため、バックエンドごとに上書きされる。
+
+        Args:
+            expected (T | None): 読み込んだ時点の行。行が存在しないことを期待する場合はNone。
+            row (T): 更新後の行
+            write (bool): すぐに書き込むかどうか
+
+        Returns:
+            bool: 更新した場合はTrue、他の書き込みと競合した場合はFalse
+        """
+        if self.get_by_index(getattr(row, self._index_col)) != expected:
+            return False
+        self.update([row], write)
+        return True
+
+    def compare_and_set_many(
+        self, pairs: list[tuple[T | None, T]], write: bool = True
+    ) -> list[bool]:
+        """
+        複数の行について、現在の行がexpectedと一致する場合に限り行を更新する。
+
+        一致しない行だけが更新されず、他の行は更新される。
+        既定の実装は1行ずつcompare_and_set()を呼ぶため、バックエンドごとに上書きされる。
+
+        Args:
+            pairs (list[tuple[T | None, T]]): 読み込んだ時点の行と更新後の行の組のリスト
+            write (bool): すぐに書き込むかどうか
+
+        Returns:
+            list[bool]: 組ごとの、更新した場合はTrue、他の書き込みと競合した場合はFalse
+        """
+        return [self.compare_and_set(expected, row, write) for expected, row in pairs]
+
+    def apply_remote(self, rows: list[T]):
+        """
+        他のノードで書き込まれた行を反映する。外部への書き込みは行わない。
+
+        既定の実装はupdate()でキャッシュのみを更新するため、バックエンドごとに上書きされる。
+
+        Args:
+            rows (list[T]): 他のノードで書き込まれた行
+        """
+        self.update(rows, write=False)
+
+    @abstractmethod
+    def delete(self, indexes: list[str]):
+        """
+        インデックスに対応するデータを削除する。
+
+        Args:
+            indexes (list[str]): 削除するデータのインデックス
+        """
+
+    def flush(self):
+        """
+        後回しにされた書き込みを行う。
+        """
+
+    def has_pending(self) -> bool:
+        """
+        後回しにされた書き込みがあるかどうか
+
+        Returns:
+            bool: 書き込み待ちの変更がある場合はTrue
+        """
+        return False
@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from pydantic import BaseModel
+from loguru import logger
+
+from enxitry import health
+from enxitry.config import CONFIG
+from .log import DefaultLogTable
+from .student import DefaultStudentsTable
+from .table import Table
+
+
+class WriteBehindQueue:
+    """
+    テーブルへの書き込みを後回しにし、まとめてシートへ書き込むキュー
+
+    書き込まれた行はまずジャーナルファイルに記録され、キャッシュにすぐ反映される。
+    シートへの書き込みはワーカースレッドがテーブルごとにまとめて行い、
+    失敗した場合はバックオフしながら再試行する。
+    起動時にジャーナルに残っている行は再度書き込まれる。
+    """
+
+    def __init__(
+        self,
+        tables: list[Table],
+        journal_path: Path,
+        flush_interval: float,
+        max_backoff: float,
+    ):
+        """
+        Args:
+            tables (list[Table]): 書き込み先のテーブル。モデル名で書き込み先が決まる。
+            journal_path (Path): ジャーナルファイルのパス
+            flush_interval (float): シートへ書き込む間隔 (秒)
+            max_backoff (float): 書き込みに失敗した場合に待つ最大の時間 (秒)
+        """
+        self._tables = {table._model.__name__: table for table in tables}
+        self._journal_path = journal_path
+        self._flush_interval = flush_interval
+        self._max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._journaled = 0
+
+        self._journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self._replay()
+
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def _replay(self):
+        """
+        ジャーナルに残っている行をテーブルに反映する。
+        """
+        if not self._journal_path.exists():
+            return
+
+        rows: dict[str, list[BaseModel]] = {}
+        with self._journal_path.open() as f:
+            for line in f:
+                self._journaled += 1
+                try:
+                    entry = json.loads(line)
+                    table = self._tables[entry["table"]]
+                    rows.setdefault(entry["table"], []).append(
+                        table._model(**entry["row"])
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to replay journal entry {line!r}: {e}")
+
+        for name, table_rows in rows.items():
+            self._tables[name].update(table_rows, write=False)
+
+        if self._journaled:
+            logger.info(f"Replayed {self._journaled} unflushed writes from journal")
+            self._event.set()
+
+    def put(self, rows: list[BaseModel]):
+        """
+        行をキューに追加する。キャッシュにはすぐに反映される。
+
+        Args:
+            rows (list[BaseModel]): 書き込む行
+        """
+        grouped: dict[str, list[BaseModel]] = {}
+        for row in rows:
+            grouped.setdefault(type(row).__name__, []).append(row)
+
+        with self._lock:
+            self._journal(rows)
+            for name, table_rows in grouped.items():
+                self._tables[name].update(table_rows, write=False)
+
+        self._event.set()
+
+    def compare_and_set(self, expected: BaseModel | None, row: BaseModel) -> bool:
+        """
+        現在の行がexpectedと一致する場合に限り、行をキューに追加する。
+
+        比較はTable.compare_and_set()で行われ、更新した場合のみジャーナルに記録される。
+        比較とジャーナルへの記録はput()と同じロックの中で行われるため、
+        ジャーナルの順序はキャッシュへの反映の順序と一致する。
+
+        Args:
+            expected (BaseModel | None): 読み込んだ時点の行。行が存在しないことを期待する場合はNone。
+            row (BaseModel): 書き込む行
+
+        Returns:
+            bool: キューに追加した場合はTrue、他の書き込みと競合した場合はFalse
+        """
+        return bool(self.compare_and_set_many([(expected, row)]))
+
+    def compare_and_set_many(
+        self,
+        pairs: list[tuple[BaseModel | None, BaseModel]],
+        extra_rows: Callable[[list[BaseModel]], list[BaseModel]] | None = None,
+    ) -> list[BaseModel]:
+        """
+        複数の行について、現在の行がexpectedと一致する場合に限り行をキューに追加する。
+
+        比較はテーブルごとにTable.compare_and_set_many()でまとめて行われる。
+        更新した行とextra_rowsが返す行は1回でジャーナルに記録されるため、
+        途中で停止しても片方だけが残ることはない。
+
+        Args:
+            pairs (list[tuple[BaseModel | None, BaseModel]]): 読み込んだ時点の行と書き込む行の組のリスト
+            extra_rows (Callable[[list[BaseModel]], list[BaseModel]] | None): 更新した行から、併せて追加する行を作る関数
+
+        Returns:
+            list[BaseModel]: キューに追加した行。他の書き込みと競合した行は含まれない。
+        """
+        grouped: dict[str, list[tuple[BaseModel | None, BaseModel]]] = {}
+        for expected, row in pairs:
+            grouped.setdefault(type(row).__name__, []).append((expected, row))
+
+        with self._lock:
+            rows = []
+            for name, table_pairs in grouped.items():
+                results = self._tables[name].compare_and_set_many(
+                    table_pairs, write=False
+                )
+                rows += [
+                    row for (_, row), result in zip(table_pairs, results) if result
+                ]
+            if not rows:
+                return []
+
+            extras = [] if extra_rows is None else extra_rows(rows)
+            self._journal(rows + extras)
+
+            extra_grouped: dict[str, list[BaseModel]] = {}
+            for row in extras:
+                extra_grouped.setdefault(type(row).__name__, []).append(row)
+            for name, table_rows in extra_grouped.items():
+                self._tables[name].update(table_rows, write=False)
+
+        self._event.set()
+        return rows
+
+    def _journal(self, rows: list[BaseModel]):
+        """
+        行をジャーナルファイルに記録する。self._lockを取得した状態で呼ぶ必要がある。
+
+        Args:
+            rows (list[BaseModel]): 記録する行
+        """
+        with self._journal_path.open("a") as f:
+            for row in rows:
+                entry = {
+                    "table": type(row).__name__,
+                    "row": row.model_dump(mode="json"),
+                }
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            # 電源が落ちても受け付けた書き込みが失われないよう、ディスクに書き出してから戻る
+            f.flush()
+            os.fsync(f.fileno())
+        self._journaled += len(rows)
+
+    def flush(self):
+        """
+        キューに溜まっている行をシートへ書き込み、ジャーナルから取り除く。
+        """
+        with self._lock:
+            flushed = self._journaled
+
+        # ジャーナルに記録済みの行は、すべてキャッシュの書き込み待ちに含まれている
+        for table in self._tables.values():
+            table.flush()
+
+        with self._lock:
+            with self._journal_path.open() as f:
+                lines = f.readlines()[flushed:]
+            tmp_path = self._journal_path.with_suffix(".tmp")
+            with tmp_path.open("w") as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            tmp_path.replace(self._journal_path)
+            self._fsync_dir()
+            self._journaled -= flushed
+
+    def _fsync_dir(self):
+        """
+        ジャーナルファイルのあるディレクトリをディスクに書き出し、ファイルの置き換えを確定させる。
+        """
+        # Windowsではディレクトリを開けないため、置き換えの確定はOSに任せる
+        if os.name != "posix":
+            return
+        fd = os.open(self._journal_path.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _worker(self):
+        backoff = self._flush_interval
+        while True:
+            self._event.wait()
+            time.sleep(self._flush_interval)
+            self._event.clear()
+
+            try:
+                self.flush()
+                backoff = self._flush_interval
+                health.report("write_queue")
+            except Exception as e:
+                logger.error(f"Failed to flush write queue, retry in {backoff}s: {e}")
+                health.report(
+                    "write_queue", f"{self._journaled} writes are waiting: {e}"
+                )
+                self._event.set()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self._max_backoff)
+
+
+class DefaultWriteBehindQueue(WriteBehindQueue):
+    """学生とログのテーブルへの書き込みキュー。シングルトン。"""
+
+    def __new__(cls, *args, **kargs):
+        if not hasattr(cls, "_instance"):
+            cls._instance = super().__new__(cls)
+            super().__init__(
+                cls._instance,
+                [DefaultStudentsTable(), DefaultLogTable()],
+                CONFIG.write_queue_journal_path,
+                CONFIG.write_queue_flush_interval,
+                CONFIG.write_queue_max_backoff,
+            )
+        return cls._instance
+
+    def __init__(self):
+        pass
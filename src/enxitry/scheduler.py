@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+import pytz
+from loguru import logger
+
+from .config import CONFIG
+
+
+DAILY_TIME_PATTERN = re.compile(r"(\d{1,2}):(\d{2})")
+
+
+def parse_daily_time(value: str) -> datetime.time:
+    """
+    "HH:MM"形式の時刻を解釈する
+
+    Args:
+        value (str): 時刻。CONFIG.log_rotationのような"04:00"形式。
+
+    Returns:
+        datetime.time: 時刻
+    """
+    match = DAILY_TIME_PATTERN.fullmatch(value.strip())
+    if match is None:
+        raise ValueError(f"Not a time of day: {value!r}")
+    return datetime.time(int(match[1]), int(match[2]))
+
+
+def get_next_run(at: datetime.time, now: datetime.datetime) -> datetime.datetime:
+    """
+    設定されたタイムゾーンで、nowより後に最初に訪れる時刻を求める
+
+    Args:
+        at (datetime.time): 時刻
+        now (datetime.datetime): 現在の日時
+
+    Returns:
+        datetime.datetime: 設定されたタイムゾーンの日時
+    """
+    tz = pytz.timezone(CONFIG.timezone)
+    local = now.astimezone(tz)
+    date = local.date()
+    while True:
+        run_at = tz.localize(datetime.datetime.combine(date, at))
+        if run_at > local:
+            return run_at
+        date += datetime.timedelta(days=1)
+
+
+@dataclass
+class DailyJob:
+    """
+    毎日決まった時刻に実行するジョブを表すデータクラス
+
+    Attributes:
+        name (str): ジョブ名
+        at (datetime.time): 設定されたタイムゾーンでの実行時刻
+        func (Callable[[], None]): 実行する関数。スレッドで実行される。
+    """
+
+    name: str
+    at: datetime.time
+    func: Callable[[], None]
+
+
+class Scheduler:
+    """
+    定期的なジョブを実行するクラス
+
+    ジョブはそれぞれ別のタスクで待機し、時刻になるとスレッドで実行される。
+    実行に失敗した場合はログに記録され、次の時刻に再び実行される。
+    """
+
+    def __init__(self):
+        self._jobs: list[DailyJob] = []
+
+    def add_daily(self, name: str, at: datetime.time, func: Callable[[], None]):
+        """
+        毎日決まった時刻に実行するジョブを追加する。run()の前に呼ぶ必要がある。
+
+        Args:
+            name (str): ジョブ名
+            at (datetime.time): 設定されたタイムゾーンでの実行時刻
+            func (Callable[[], None]): 実行する関数
+        """
+        self._jobs.append(DailyJob(name, at, func))
+
+    async def run(self):
+        """
+        全てのジョブの実行を開始する
+        """
+        await asyncio.gather(*(self._run_daily(job) for job in self._jobs))
+
+    async def _run_daily(self, job: DailyJob):
+        while True:
+            now = datetime.datetime.now(datetime.UTC)
+            run_at = get_next_run(job.at, now)
+            logger.info(f"Job {job.name} is scheduled at {run_at.isoformat()}")
+            await asyncio.sleep((run_at - now).total_seconds())
+
+            try:
+                await asyncio.to_thread(job.func)
+            except Exception as e:
+                logger.error(f"Job {job.name} failed: {e}")
+
+
+scheduler = Scheduler()
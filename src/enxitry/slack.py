@@ -1,17 +1,223 @@
-import requests
-import json
+import asyncio
+import threading
+import time
+
+import httpx
+from loguru import logger
 
 from .config import CONFIG
 
 
+class SlackNotifier:
+    """
+    Slackへのメッセージの送信をバックグラウンドでまとめて行うクラス
+
+    メッセージはキューに積まれるだけで呼び出し元を待たせない。
+    最初のメッセージから一定時間の間に積まれたものは1通にまとめられ、
+    同じ動作の通知は「3人が入室しました」のように集約される。
+    送信は使い回されるHTTPクライアントで行われ、失敗した場合は間隔を空けて再送される。
+    """
+
+    def __init__(
+        self,
+        webhook_url: str,
+        coalesce_window: float,
+        timeout: float,
+        max_retries: int,
+        min_interval: float,
+        max_backoff: float = 60,
+    ):
+        """
+        Args:
+            webhook_url (str): Incoming WebhookのURL。空文字列の場合は何も送信しない。
+            coalesce_window (float): メッセージをまとめる時間 (秒)
+            timeout (float): 1回の送信のタイムアウト (秒)
+            max_retries (int): 送信に失敗した場合に再送する回数
+            min_interval (float): 送信と送信の間に空ける時間 (秒)
+            max_backoff (float): 再送までに待つ時間の上限 (秒)
+        """
+        self._webhook_url = webhook_url
+        self._coalesce_window = coalesce_window
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._min_interval = min_interval
+        self._max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._pending: list[tuple[str | None, str]] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._next_post_at = 0.0
+
+    def send_message(self, message: str):
+        """
+        メッセージを送信キューに積む
+
+        Args:
+            message (str): メッセージ
+        """
+        self._put(None, message)
+
+    def notify(self, action: str, name: str):
+        """
+        学生の動作の通知を送信キューに積む。同じ動作の通知はまとめて送信される。
+
+        Args:
+            action (str): 動作。「入室」のように「しました」に続く形で指定する。
+            name (str): 学生氏名
+        """
+        self._put(action, name)
+
+    def _put(self, action: str | None, text: str):
+        if not self._webhook_url:
+            return
+
+        with self._lock:
+            self._pending.append((action, text))
+            loop, wakeup = self._loop, self._wakeup
+
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def _take_message(self) -> str | None:
+        """
+        積まれた通知を取り出し、1通のメッセージにまとめる。
+
+        Returns:
+            str | None: メッセージ。積まれた通知がない場合はNone。
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        if not pending:
+            return None
+
+        entries: list[str | tuple[str]] = []
+        names_by_action: dict[str, list[str]] = {}
+        for action, text in pending:
+            if action is None:
+                entries.append(text)
+            elif action in names_by_action:
+                names_by_action[action].append(text)
+            else:
+                # 集約した通知は最初に積まれた位置に置く
+                names_by_action[action] = [text]
+                entries.append((action,))
+
+        lines = []
+        for entry in entries:
+            if isinstance(entry, str):
+                lines.append(entry)
+                continue
+            action = entry[0]
+            names = names_by_action[action]
+            if len(names) == 1:
+                lines.append(f"{names[0]}さんが{action}しました。")
+            else:
+                lines.append(f"{len(names)}人が{action}しました: {'、'.join(names)}")
+
+        return "\n".join(lines)
+
+    async def _post(
+        self, client: httpx.AsyncClient, message: str, max_retries: int | None = None
+    ):
+        """
+        メッセージを送信する。失敗した場合は間隔を空けて再送する。
+
+        Args:
+            client (httpx.AsyncClient): HTTPクライアント
+            message (str): メッセージ
+            max_retries (int | None): 再送する回数。Noneの場合は設定された回数。
+        """
+        if max_retries is None:
+            max_retries = self._max_retries
+
+        for attempt in range(max_retries + 1):
+            delay = self._next_post_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            backoff = min(2**attempt, self._max_backoff)
+            try:
+                response = await client.post(self._webhook_url, json={"text": message})
+            except httpx.HTTPError as e:
+                error = str(e) or type(e).__name__
+            else:
+                if response.is_success:
+                    self._next_post_at = time.monotonic() + self._min_interval
+                    return
+                if response.status_code == 429:
+                    # レート制限に達した場合は指定された時間だけ待つ
+                    retry_after = response.headers.get("Retry-After", "")
+                    if retry_after.isdigit():
+                        backoff = int(retry_after)
+                elif response.status_code < 500:
+                    logger.error(
+                        f"Slack rejected a message: {response.status_code} {response.text}"
+                    )
+                    return
+                error = f"HTTP {response.status_code}"
+
+            logger.warning(
+                f"Failed to send a message to Slack (attempt {attempt + 1}): {error}"
+            )
+            self._next_post_at = time.monotonic() + backoff
+
+        logger.error(f"Gave up sending a message to Slack: {message}")
+
+    async def run(self):
+        """
+        積まれたメッセージを送信し続ける
+        """
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            if self._pending:
+                self._wakeup.set()
+
+        async with httpx.AsyncClient(timeout=self._timeout) as client:
+            try:
+                while True:
+                    await self._wakeup.wait()
+                    await asyncio.sleep(self._coalesce_window)
+                    self._wakeup.clear()
+
+                    message = self._take_message()
+                    if message is not None:
+                        await self._post(client, message)
+            except asyncio.CancelledError:
+                # 終了時は積まれている分を1度だけ送信してみる
+                message = self._take_message()
+                if message is not None:
+                    await self._post(client, message, max_retries=0)
+                raise
+
+
+notifier = SlackNotifier(
+    CONFIG.slack_webhook_url,
+    CONFIG.slack_coalesce_window,
+    CONFIG.slack_timeout,
+    CONFIG.slack_max_retries,
+    CONFIG.slack_min_interval,
+)
+
+
 def send_message(message: str):
     """
-    Slackにメッセージを送信する
+    Slackにメッセージを送信する。送信はバックグラウンドで行われる。
 
     Args:
         message (str): メッセージ
     """
-    requests.post(
-        CONFIG.slack_webhook_url,
-        data=json.dumps({"text": message}),
-    )
+    notifier.send_message(message)
+
+
+def notify(action: str, name: str):
+    """
+    学生の動作をSlackに通知する。短時間に続いた同じ動作の通知は1通にまとめられる。
+
+    Args:
+        action (str): 動作。「入室」のように「しました」に続く形で指定する。
+        name (str): 学生氏名
+    """
+    notifier.notify(action, name)
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import cv2
+from fastapi.responses import StreamingResponse
+
+from .card import ocr
+from .card.camera import Frame
+from .config import CONFIG
+
+
+CAMERA_STREAM_PATH = "/camera.mjpg"
+BOUNDARY = "frame"
+
+
+class CameraStreamer:
+    """
+    カメラの画像をMJPEGとして配信するクラス
+
+    画像は1枚につき1回だけJPEGに変換され、全ての接続で共有される。
+    """
+
+    def __init__(self, quality: int, fps: float, size: int):
+        """
+        Args:
+            quality (int): JPEGの品質 (0-100)
+            fps (float): 配信するフレームレート
+            size (int): 配信する画像の長辺の最大の長さ
+        """
+        self._quality = quality
+        self._interval = 1 / fps
+        self._size = size
+        self._lock = threading.Lock()
+        self._encoded: tuple[int, bytes] | None = None
+
+    def _encode(self, frame: Frame) -> bytes:
+        """
+        画像をJPEGに変換する。同じ画像が既に変換されている場合はその結果を返す。
+
+        Args:
+            frame (Frame): 画像
+
+        Returns:
+            bytes: JPEG
+        """
+        with self._lock:
+            if self._encoded is not None and self._encoded[0] == frame.seq:
+                return self._encoded[1]
+
+        image = frame.image
+        factor = min(1, self._size / max(image.shape[:2]))
+        if factor < 1:
+            image = cv2.resize(image, (0, 0), fx=factor, fy=factor)
+        _, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self._quality])
+
+        with self._lock:
+            self._encoded = (frame.seq, jpeg.tobytes())
+            return self._encoded[1]
+
+    async def stream(self):
+        """
+        カメラが開いている間、新しい画像をmultipartの各パートとして返す。
+
+        Yields:
+            bytes: multipartの1パート
+        """
+        seq = -1
+        while (camera := ocr.get_opened_camera()) is not None:
+            frame = camera.latest()
+            if frame is not None and frame.seq != seq:
+                seq = frame.seq
+                jpeg = await asyncio.to_thread(self._encode, frame)
+                yield (
+                    (
+                        f"--{BOUNDARY}\r\n"
+                        "Content-Type: image/jpeg\r\n"
+                        f"Content-Length: {len(jpeg)}\r\n\r\n"
+                    ).encode()
+                    + jpeg
+                    + b"\r\n"
+                )
+            await asyncio.sleep(self._interval)
+
+
+camera_streamer = CameraStreamer(
+    CONFIG.camera_stream_quality,
+    CONFIG.camera_stream_fps,
+    CONFIG.size_displayed_camera_image,
+)
+
+
+async def camera_stream() -> StreamingResponse:
+    """
+    カメラの画像をMJPEGで配信するエンドポイント
+    """
+    return StreamingResponse(
+        camera_streamer.stream(),
+        media_type=f"multipart/x-mixed-replace; boundary={BOUNDARY}",
+        headers={"Cache-Control": "no-store"},
+    )
@@ -0,0 +1,206 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from gspread.utils import a1_to_rowcol
+
+from enxitry.models import gspread as gspread_table
+from enxitry.models.gspread import GSpreadTable
+from enxitry.models.student import Student, StudentStatus
+
+
+class FakeSheet:
+    """複数のテーブルから共有される1枚のシート。0行目はヘッダ。"""
+
+    id = 0
+
+    def __init__(self, rows: list[list[str]]):
+        self.rows = rows
+        self.full_reads = 0
+
+    def col_values(self, col: int) -> list[str]:
+        return [row[col - 1] for row in self.rows]
+
+    def batch_get(self, ranges: list[str]) -> list[list[list[str]]]:
+        values = []
+        for a1 in ranges:
+            start, end = a1.split(":")
+            row, first = a1_to_rowcol(start)
+            _, last = a1_to_rowcol(end)
+            cells = (
+                self.rows[row - 1][first - 1 : last] if row <= len(self.rows) else []
+            )
+            values.append([cells] if cells else [])
+        return values
+
+    def batch_update(self, body: dict):
+        for request in body["requests"]:
+            if "updateCells" in request:
+                update = request["updateCells"]
+                row = update["start"]["rowIndex"]
+                self.rows[row] = self._values(update["rows"][0])
+            elif "appendCells" in request:
+                for row in request["appendCells"]["rows"]:
+                    self.rows.append(self._values(row))
+            elif "deleteDimension" in request:
+                del self.rows[request["deleteDimension"]["range"]["startIndex"]]
+
+    def _values(self, row: dict) -> list[str]:
+        return [cell["userEnteredValue"]["stringValue"] for cell in row["values"]]
+
+
+class FakeSpread:
+    """gspread_pandas.Spreadのうち、GSpreadTableが使う操作だけを持つ偽物"""
+
+    def __init__(self, sheet: FakeSheet):
+        self.sheet = sheet
+        self.spread = sheet
+
+    def sheet_to_df(self) -> pd.DataFrame:
+        self.sheet.full_reads += 1
+        header, *rows = self.sheet.rows
+        df = pd.DataFrame(rows, columns=header, dtype=str)
+        return df.set_index(header[0])
+
+    def df_to_sheet(self, df: pd.DataFrame, replace: bool = False):
+        df = df.reset_index()
+        self.sheet.rows[:] = [list(df.columns)] + df.astype(str).values.tolist()
+
+
+@pytest.fixture
+def sheet(monkeypatch) -> FakeSheet:
+    sheet = FakeSheet(
+        [
+            ["sid", "idm", "name", "status"],
+            ["s1", "idm1", "Alice", StudentStatus.ENTERED],
+            ["s2", "idm2", "Bob", StudentStatus.EXITED],
+        ]
+    )
+    monkeypatch.setattr(
+        gspread_table, "Spread", lambda *args, **kwargs: FakeSpread(sheet)
+    )
+    monkeypatch.setattr(gspread_table, "get_config", lambda *args: None)
+    return sheet
+
+
+def open_table() -> GSpreadTable[Student]:
+    return GSpreadTable(
+        Student,
+        "https://example.com/spreadsheet",
+        Path("service-account.json"),
+        unique_cols=["idm"],
+        sync_interval=0,
+    )
+
+
+def test_compare_and_set_detects_other_writer(sheet: FakeSheet):
+    exit_door, enter_door = open_table(), open_table()
+
+    student = exit_door.get_by_index("s1")
+    assert exit_door.compare_and_set(
+        student, student.model_copy(update={"status": StudentStatus.EXITED})
+    )
+
+    # 入室用の端末は退出を知らないまま、古い行を元に書き込もうとする
+    stale = enter_door.get_by_index("s1")
+    assert stale.status == StudentStatus.ENTERED
+    assert not enter_door.compare_and_set(
+        stale, stale.model_copy(update={"name": "Alice Smith"})
+    )
+
+    # 競合した端末のキャッシュはシートの内容に揃う
+    assert sheet.rows[1] == ["s1", "idm1", "Alice", StudentStatus.EXITED]
+    assert enter_door.get_by_index("s1") == exit_door.get_by_index("s1")
+    assert not enter_door.has_pending()
+
+
+def test_compare_and_set_retry_after_conflict(sheet: FakeSheet):
+    exit_door, enter_door = open_table(), open_table()
+
+    exited = exit_door.get_by_index("s1")
+    stale = enter_door.get_by_index("s1")
+    assert exit_door.compare_and_set(
+        exited, exited.model_copy(update={"status": StudentStatus.EXITED})
+    )
+    assert not enter_door.compare_and_set(
+        stale, stale.model_copy(update={"status": StudentStatus.EXITED})
+    )
+
+    # 読み直した行を元にすれば書き込める
+    current = enter_door.get_by_index("s1")
+    assert current.status == StudentStatus.EXITED
+    assert enter_door.compare_and_set(
+        current, current.model_copy(update={"status": StudentStatus.ENTERED})
+    )
+    assert sheet.rows[1][3] == StudentStatus.ENTERED
+
+    # 先に書き込んだ端末も、次の書き込みで競合を検出する
+    assert not exit_door.compare_and_set(
+        exit_door.get_by_index("s1"),
+        exited.model_copy(update={"name": "Alice Smith"}),
+    )
+    assert exit_door.get_by_index("s1") == enter_door.get_by_index("s1")
+
+
+def test_update_merges_with_other_writer(sheet: FakeSheet):
+    a, b = open_table(), open_table()
+
+    alice = a.get_by_index("s1")
+    a.update([alice.model_copy(update={"status": StudentStatus.EXITED})])
+    bob = b.get_by_index("s2")
+    b.update([bob.model_copy(update={"status": StudentStatus.ENTERED})])
+
+    # compare_and_setでない書き込みは行ごとにシートへ反映される
+    assert [row[3] for row in sheet.rows[1:]] == [
+        StudentStatus.EXITED,
+        StudentStatus.ENTERED,
+    ]
+
+
+def test_apply_remote_adds_unknown_row_without_reading_sheet(sheet: FakeSheet):
+    a, b = open_table(), open_table()
+    full_reads = sheet.full_reads
+
+    carol = Student(sid="s3", idm="idm3", name="Carol", status=StudentStatus.EXITED)
+    a.update([carol], write=False)
+    b.apply_remote([carol])
+    assert b.get_by("idm", "idm3") == carol
+    assert sheet.full_reads == full_reads
+
+    # 他のノードがシートへ書き込むまで、位置の分からない行は書き込まれない
+    entered = carol.model_copy(update={"status": StudentStatus.ENTERED})
+    b.update([entered])
+    assert len(sheet.rows) == 3
+    assert b.has_pending()
+
+    a.flush()
+    b.flush()
+    assert sheet.rows[1:] == [
+        ["s1", "idm1", "Alice", StudentStatus.ENTERED],
+        ["s2", "idm2", "Bob", StudentStatus.EXITED],
+        ["s3", "idm3", "Carol", StudentStatus.ENTERED],
+    ]
+    assert not b.has_pending()
+
+
+def test_compare_and_set_many_skips_only_conflicting_rows(sheet: FakeSheet):
+    sweep, kiosk = open_table(), open_table()
+
+    alice, bob = sweep.get_by_index("s1"), sweep.get_by_index("s2")
+    stale = kiosk.get_by_index("s1")
+    assert kiosk.compare_and_set(
+        stale, stale.model_copy(update={"status": StudentStatus.EXITED})
+    )
+
+    results = sweep.compare_and_set_many(
+        [
+            (alice, alice.model_copy(update={"name": "Alice Smith"})),
+            (bob, bob.model_copy(update={"name": "Bob Jones"})),
+        ]
+    )
+    assert results == [False, True]
+    assert sheet.rows[1:] == [
+        ["s1", "idm1", "Alice", StudentStatus.EXITED],
+        ["s2", "idm2", "Bob Jones", StudentStatus.EXITED],
+    ]
+    assert sweep.get_by_index("s1") == kiosk.get_by_index("s1")